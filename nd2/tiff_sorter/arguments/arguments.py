@@ -1,5 +1,9 @@
 import click
-from nd2_tools.nd2_wrapper import ND2Wrapper
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
+from works.run_manifest import get_run_manifest_dir
+
+# tiff compression codecs taking a compression level
+TIFF_COMPRESSION_LEVEL_CODECS = ['zlib', 'zstd', 'lzma']
 import os
 import json
 
@@ -19,12 +23,33 @@ class Arguments:
         self.matlab_output_dir = None
         self.piv_params_file = None
         self.calibration_file = None
+        self.piv_engine = 'matlab'
+        self.piv_output_format = 'mat'
         self.z_axis_profile_output_dir = None
         self.z_axis_profile_single_output_file = False
         self.z_axis_profile_plot = False
+        self.z_axis_profile_stats = []
+        self.reader_backend = 'nd2reader'
+        self.tiff_output_mode = 'files'
+        self.tiff_contiguous = False
+        self.writer_threads = 0
+        self.tiff_compression = 'none'
+        self.tiff_compression_level = None
+        self.tiff_predictor = False
+        self.tiff_tile = None
+        self.tiff_compression_workers = 0
+        self.zarr_output_dir = None
+        self.zarr_chunks = [16, 512, 512]
+        self.zarr_compressor = 'zstd'
+        self.resume = False
+        self.checkpoint = False
+        # [start, stop, step] python slice of the time axis, None processes all timepoints
+        self.timepoints = None
+        self.piv_pair_gap = 1
+        self.headless = False
 
     def fill_in_multipoints_channels(self):
-        nd2_wrapper = ND2Wrapper.instance(self.input_file)
+        nd2_wrapper = get_nd2_wrapper(self.input_file, self.reader_backend)
         if self.multipoints is None:
             self.multipoints = list(range(nd2_wrapper.get_multipoints_number()))
         if self.channels is None:
@@ -34,8 +59,15 @@ class Arguments:
             multipoints=None, channels=None,
             parallel = False, output_dir=None,
             matlab_output_dir=None, piv_params_file=None, calibration_file=None,
-            z_axis_profile_output_dir=None, z_axis_profile_single_output_file=False, z_axis_profile_plot=False):
+            z_axis_profile_output_dir=None, z_axis_profile_single_output_file=False, z_axis_profile_plot=False,
+            reader_backend='nd2reader', tiff_output_mode='files', tiff_contiguous=False,
+            writer_threads=0, tiff_compression='none', tiff_compression_level=None, tiff_predictor=False,
+            tiff_tile=None, tiff_compression_workers=0, zarr_output_dir=None, zarr_chunks=None,
+            zarr_compressor='zstd', z_axis_profile_stats=None, piv_engine='matlab',
+            piv_output_format='mat', resume=False, timepoints=None, piv_pair_gap=1, headless=False,
+            checkpoint=False):
         self.input_file = input_file
+        self.reader_backend = reader_backend
         self.gui = gui
         self.output_dir = output_dir
         self.multipoints = multipoints
@@ -50,9 +82,29 @@ class Arguments:
         self.matlab_output_dir = matlab_output_dir
         self.piv_params_file = piv_params_file
         self.calibration_file = calibration_file
+        self.piv_engine = piv_engine
+        self.piv_output_format = piv_output_format
         self.z_axis_profile_output_dir = z_axis_profile_output_dir
         self.z_axis_profile_single_output_file= z_axis_profile_single_output_file
         self.z_axis_profile_plot = z_axis_profile_plot
+        self.z_axis_profile_stats = [] if z_axis_profile_stats is None else z_axis_profile_stats
+        self.tiff_output_mode = tiff_output_mode
+        self.tiff_contiguous = tiff_contiguous
+        self.writer_threads = writer_threads
+        self.tiff_compression = tiff_compression
+        self.tiff_compression_level = tiff_compression_level
+        self.tiff_predictor = tiff_predictor
+        self.tiff_tile = tiff_tile
+        self.tiff_compression_workers = tiff_compression_workers
+        self.zarr_output_dir = zarr_output_dir
+        if zarr_chunks is not None:
+            self.zarr_chunks = zarr_chunks
+        self.zarr_compressor = zarr_compressor
+        self.resume = resume
+        self.checkpoint = checkpoint
+        self.timepoints = timepoints
+        self.piv_pair_gap = piv_pair_gap
+        self.headless = headless
 
     @classmethod
     def instance(cls):
@@ -70,12 +122,60 @@ class Arguments:
     def is_tiff_write(self):
         return self.output_dir is not None
 
+    def is_zarr_write(self):
+        return self.zarr_output_dir is not None
+
+    def is_tiff_stack(self):
+        return self.tiff_output_mode in ['stack', 'ome_stack']
+
+    def is_ome_tiff(self):
+        return self.tiff_output_mode == 'ome_stack'
+
+    def get_tiff_compression_options(self):
+        """Returns the tifffile write arguments of the selected tiff compression"""
+        res = {}
+        if self.tiff_compression != 'none':
+            res['compression'] = self.tiff_compression
+            # lzw takes no level
+            if self.tiff_compression_level is not None and self.tiff_compression in TIFF_COMPRESSION_LEVEL_CODECS:
+                res['compressionargs'] = {'level': self.tiff_compression_level}
+            if self.tiff_predictor:
+                res['predictor'] = True
+            if self.tiff_tile is not None:
+                res['tile'] = (self.tiff_tile, self.tiff_tile)
+            # tiles / strips of a frame are compressed in parallel, None lets tifffile choose
+            res['maxworkers'] = self.tiff_compression_workers if self.tiff_compression_workers > 0 else None
+        return res
+
     def is_pivlab(self):
         return all([self.matlab_output_dir, self.piv_params_file, self.calibration_file])
 
     def is_z_axis_profile(self):
         return self.z_axis_profile_output_dir is not None or self.z_axis_profile_plot
 
+    def get_z_axis_profile_stats(self):
+        """Returns the statistics to compute per frame, mean first"""
+        return ['mean'] + [stat for stat in self.z_axis_profile_stats if stat != 'mean']
+
+    def get_timepoints_range(self, timepoints_number):
+        """Returns the range of the timepoints to process out of the timepoints_number of the file"""
+        res = range(timepoints_number)
+        if self.timepoints is not None:
+            res = res[slice(*self.timepoints)]
+        return res
+
+    def get_timepoints_suffix(self, timepoints_number):
+        """Output names suffix of the processed part of the time axis, empty when all timepoints are processed"""
+        res = ''
+        if self.timepoints is not None:
+            timepoints = self.get_timepoints_range(timepoints_number)
+            res = f"_t{timepoints.start}-{timepoints.stop}-{timepoints.step}"
+        return res
+
+    def get_piv_pairs_number(self, frames):
+        """PIV pairs frame k and frame k + piv_pair_gap of the processed frames"""
+        return max(frames - self.piv_pair_gap, 0)
+
     def should_plot_z_axis_profile(self):
         return self.z_axis_profile_plot
 
@@ -93,6 +193,40 @@ class Arguments:
     def should_parallel(self):
         return self.parallel
 
+    def is_checkpoint(self):
+        """Whether series progress is recorded in the run manifest, a resumed run keeps recording it"""
+        return self.checkpoint or self.resume
+
+    def get_run_manifest_dir(self):
+        """Run manifest directory, under the first output directory, None when no checkpoint is recorded"""
+        res = None
+        output_dirs = [self.output_dir, self.zarr_output_dir, self.matlab_output_dir, self.z_axis_profile_output_dir]
+        output_dirs = [output_dir for output_dir in output_dirs if output_dir is not None]
+        if self.is_checkpoint() and len(output_dirs) > 0:
+            res = get_run_manifest_dir(output_dirs[0], self.input_file)
+        return res
+
+    def get_run_config(self):
+        """Arguments shaping the outputs of a series, a run is resumed only with the same values"""
+        res = {'input_file': self.input_file, 'roi': self.roi, 'timepoints': self.timepoints}
+        if self.is_tiff_write():
+            res.update(output_dir=self.output_dir, tiff_output_mode=self.tiff_output_mode,
+                       tiff_contiguous=self.tiff_contiguous, tiff_compression=self.tiff_compression,
+                       tiff_compression_level=self.tiff_compression_level, tiff_predictor=self.tiff_predictor,
+                       tiff_tile=self.tiff_tile)
+        if self.is_zarr_write():
+            res.update(zarr_output_dir=self.zarr_output_dir, zarr_chunks=self.zarr_chunks,
+                       zarr_compressor=self.zarr_compressor)
+        if self.is_z_axis_profile():
+            res.update(z_axis_profile_output_dir=self.z_axis_profile_output_dir,
+                       z_axis_profile_single_output_file=self.z_axis_profile_single_output_file,
+                       z_axis_profile_stats=self.get_z_axis_profile_stats())
+        if self.is_pivlab():
+            res.update(matlab_output_dir=self.matlab_output_dir, piv_params_file=self.piv_params_file,
+                       calibration_file=self.calibration_file, piv_engine=self.piv_engine,
+                       piv_output_format=self.piv_output_format, piv_pair_gap=self.piv_pair_gap)
+        return res
+
 
 if __name__ == '__main__':
     cli()
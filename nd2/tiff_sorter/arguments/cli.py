@@ -1,15 +1,17 @@
 import click
 import os
-from arguments.arguments import Arguments
+from arguments.arguments import Arguments, TIFF_COMPRESSION_LEVEL_CODECS
 from arguments.int_list_or_int import IntListOrInt
-from gui.main_window import MainWindow
-from works.single_process_orchestrator import SingleProcessOrchestrator
-from works.multi_process_orchestrator import MultiProcessOrchestrator
+from arguments.z_axis_profile_stats import ZAxisProfileStats
+from arguments.timepoints_range import TimepointsRange
+from piv_tools.piv_processor_factory import PIV_ENGINES
 
 
 def validate_args(gui, input_file, roi_file, matlab_output_dir, piv_params_file, calibration_file,
                   z_axis_profile_output_dir, z_axis_profile_single_output_file, z_axis_profile_plot,
-                  output_dir):
+                  output_dir, tiff_output_mode='files', tiff_contiguous=False, tiff_compression='none',
+                  tiff_tile=None, zarr_output_dir=None, zarr_chunks=None, headless=False, checkpoint=False,
+                  resume=False, z_axis_profile_stats=None, tiff_compression_level=None, tiff_predictor=False):
     # Input file is required when gui is not selected
     if gui is False and input_file is None:
         raise click.UsageError(
@@ -41,25 +43,72 @@ def validate_args(gui, input_file, roi_file, matlab_output_dir, piv_params_file,
     # Constraint 4: z-axis-profile requires at least one output method
     is_pivlab = all(pivlab_args)
     is_z_axis = z_axis_profile_output_dir or z_axis_profile_plot
-    if not is_pivlab and not is_z_axis and not output_dir:
+    if not is_pivlab and not is_z_axis and not output_dir and not zarr_output_dir:
         raise click.UsageError(
-            "No use-case selected. Provide --output_dir (tiff-write), "
+            "No use-case selected. Provide --output_dir (tiff-write), --zarr_output_dir (zarr-write), "
             "all pivlab options, or at least one of "
             "--z_axis_profile_output_dir / --z_axis_profile_plot"
         )
 
+    # Constraint: zarr chunks are given for the t, y and x axes
+    if zarr_chunks is not None and len(zarr_chunks) != 3:
+        raise click.UsageError(
+            "--zarr_chunks expects 3 values: t,y,x"
+        )
+
     # Constraint: user cannot state he wants a single output for z-axis-profile results and don't set output directory
     if z_axis_profile_single_output_file and z_axis_profile_output_dir is None:
         raise click.UsageError(
             "When setting z_axis_profile_single_output_file user must set also z_axis_profile_output_dir"
         )
 
-    # Constraint 5: pivlab and z-axis-profile are mutually exclusive
-    if is_pivlab and is_z_axis:
+    # Constraint: the single z-axis-profile file holds the mean of every series, additional statistics are written
+    # to the file of each series
+    if z_axis_profile_single_output_file and z_axis_profile_stats:
+        raise click.UsageError(
+            "--z_axis_profile_stats can't be combined with --z_axis_profile_single_output_file"
+        )
+
+    # Constraint: contiguous layout applies to the single file tiff output modes
+    if tiff_contiguous and tiff_output_mode == 'files':
+        raise click.UsageError(
+            "--tiff_contiguous requires --tiff_output_mode stack or ome_stack"
+        )
+
+    # Constraint: contiguous layout stores raw pixel data
+    if tiff_contiguous and tiff_compression != 'none':
+        raise click.UsageError(
+            "--tiff_contiguous can't be combined with --tiff_compression"
+        )
+
+    # Constraint: headless runs open no windows
+    if headless and (gui or z_axis_profile_plot):
+        raise click.UsageError(
+            "--headless can't be combined with --gui or --z_axis_profile_plot"
+        )
+
+    # Constraint: the run manifest is kept under an output directory
+    if (checkpoint or resume) and not any([output_dir, zarr_output_dir, matlab_output_dir, z_axis_profile_output_dir]):
+        raise click.UsageError(
+            "--checkpoint and --resume require an output directory"
+        )
+
+    # Constraint: tiles, predictor and level are options of a compressed tiff
+    if tiff_compression == 'none' and (tiff_tile is not None or tiff_predictor or tiff_compression_level is not None):
+        raise click.UsageError(
+            "--tiff_tile, --tiff_predictor and --tiff_compression_level require --tiff_compression"
+        )
+
+    # Constraint: the compression level is an option of the codecs taking one
+    if tiff_compression_level is not None and tiff_compression not in ['none'] + TIFF_COMPRESSION_LEVEL_CODECS:
+        raise click.UsageError(
+            f"--tiff_compression_level can't be combined with --tiff_compression {tiff_compression}"
+        )
+
+    # Constraint: tiff tiles must be a multiple of 16 pixels
+    if tiff_tile is not None and tiff_tile % 16 != 0:
         raise click.UsageError(
-            "--matlab_output_dir/--piv_params_file/--calibration_file (pivlab) "
-            "and --z_axis_profile_output_dir/--z_axis_profile_plot (z-axis-profile) "
-            "are mutually exclusive use-cases"
+            "--tiff_tile must be a multiple of 16"
         )
 
 
@@ -73,7 +122,8 @@ def validate_args(gui, input_file, roi_file, matlab_output_dir, piv_params_file,
 @click.option('--channels', type=IntListOrInt(), default=None,
               help='[all] Channels to process. Single value (1) or list ([0,1,3])')
 @click.option('--parallel', is_flag=True, help='[all] Whether to perform parallel computation using processes '
-                                               'assigned to [multipoint, channel] combinations')
+                                               'assigned to [multipoint, channel] combinations. '
+                                               'Long series are split by time range when cores outnumber series')
 @click.option('--roi_file',
               help='[all] json file with region of interest settings. '
                    'If omitted, the full image is used.')
@@ -89,14 +139,69 @@ def validate_args(gui, input_file, roi_file, matlab_output_dir, piv_params_file,
               help='[z-axis-profile] A single csv_utils file will be created to all positions')
 @click.option('--z_axis_profile_plot', is_flag=True,
               help='[z-axis-profile] Plot the z-axis-profile values to graph')
+@click.option('--reader_backend', type=click.Choice(['nd2reader', 'nd2']), default='nd2reader',
+              help='[all] nd2 reading library. nd2 serves frames as zero-copy views over the memory-mapped file')
+@click.option('--tiff_output_mode', type=click.Choice(['files', 'stack', 'ome_stack']), default='files',
+              help='[tiff-write] files: a directory per series with a tiff file per frame, '
+                   'stack / ome_stack: a single BigTIFF / OME-TIFF file per series')
+@click.option('--tiff_contiguous', is_flag=True,
+              help='[tiff-write] Store the frames of a stack contiguously so the file can be memory-mapped')
+@click.option('--writer_threads', type=int, default=0,
+              help='[tiff-write] Number of threads writing tiff files behind the reader. '
+                   '0 writes each frame before reading the next one')
+@click.option('--tiff_compression', type=click.Choice(['none', 'zlib', 'zstd', 'lzw']), default='none',
+              help='[tiff-write] Compression of the written tiff files')
+@click.option('--tiff_compression_level', type=int, default=None,
+              help='[tiff-write] zlib / zstd compression level')
+@click.option('--tiff_predictor', is_flag=True,
+              help='[tiff-write] Apply horizontal differencing predictor before compression')
+@click.option('--tiff_tile', type=int, default=None,
+              help='[tiff-write] Write compressed frames in square tiles of this size (multiple of 16), '
+                   'tiles are compressed in parallel')
+@click.option('--tiff_compression_workers', type=int, default=0,
+              help='[tiff-write] Threads compressing tiles of a frame. 0 lets tifffile choose')
+@click.option('--zarr_output_dir',
+              help='[zarr-write] Path to directory where an OME-Zarr store, a (T, C, Y, X) array per multipoint, '
+                   'will be written')
+@click.option('--zarr_chunks', type=IntListOrInt(), default=None,
+              help='[zarr-write] Chunk shape t,y,x (default 16,512,512). Each chunk holds a single channel')
+@click.option('--zarr_compressor', type=click.Choice(['zstd', 'lz4', 'zlib', 'none']), default='zstd',
+              help='[zarr-write] Compressor of the zarr chunks')
+@click.option('--z_axis_profile_stats', type=ZAxisProfileStats(), default=None,
+              help='[z-axis-profile] Additional per frame statistics written next to the mean in the file of '
+                   'each series, comma separated: std, min, max, sum, p<q> (e.g. p5,p95)')
+@click.option('--piv_engine', type=click.Choice(PIV_ENGINES), default='matlab',
+              help='[pivlab] matlab: PIVlab through the MATLAB engine, numpy: multi-pass FFT PIV in python, '
+                   'no MATLAB installation required')
+@click.option('--piv_output_format', type=click.Choice(['mat', 'mat73']), default='mat',
+              help='[pivlab] mat: results of a series are saved when it ends (cell arrays per pair), '
+                   'mat73: pairs are streamed into a MATLAB v7.3 (HDF5) file as rows x cols x pairs arrays')
+@click.option('--checkpoint', is_flag=True,
+              help='[all] Record the processed frames of every series in a run manifest (<input name>.run under the '
+                   'first output directory), so an interrupted run can be continued with --resume')
+@click.option('--resume', is_flag=True,
+              help='[all] Skip the series completed by a previous --checkpoint run with the same arguments and '
+                   'continue partially processed series from their last checkpoint. Implies --checkpoint')
+@click.option('--timepoints', type=TimepointsRange(), default=None,
+              help='[all] Part of the time axis to process, start:stop:step python slice (e.g. 0:500 or ::10). '
+                   'Frames out of it are not read')
+@click.option('--piv_pair_gap', type=click.IntRange(min=1), default=1,
+              help='[pivlab] Pair frame k with frame k + piv_pair_gap of the processed frames (default 1)')
+@click.option('--headless', is_flag=True,
+              help='[all] Run without windows (no tkinter / matplotlib), progress is printed to the terminal')
 def cli(gui, input_file, multipoints, channels, parallel, roi_file, output_dir, matlab_output_dir, piv_params_file,
-        calibration_file, z_axis_profile_output_dir, z_axis_profile_single_output_file, z_axis_profile_plot):
+        calibration_file, z_axis_profile_output_dir, z_axis_profile_single_output_file, z_axis_profile_plot,
+        reader_backend, tiff_output_mode, tiff_contiguous, writer_threads, tiff_compression, tiff_compression_level,
+        tiff_predictor, tiff_tile, tiff_compression_workers, zarr_output_dir, zarr_chunks, zarr_compressor,
+        z_axis_profile_stats, piv_engine, piv_output_format, checkpoint, resume, timepoints, piv_pair_gap,
+        headless):
     """Process --input_file (.nd2) according to the selected use-case(s).
 
     \b
     Use-cases:
       gui              : --gui
       tiff-write       : --output_dir
+      zarr-write       : --zarr_output_dir
       pivlab           : --matlab_output_dir + --piv_params_file + --calibration_file
       z-axis-profile   : --z_axis_profile_output_dir (with or without z_axis_profile_single_output_file)
                         and/or --z_axis_profile_plot
@@ -104,12 +209,13 @@ def cli(gui, input_file, multipoints, channels, parallel, roi_file, output_dir,
     \b
     Constraints:
       - input_file is mandatory to all use-cases but gui
-      - pivlab and z-axis-profile are mutually exclusive
-      - tiff-write can be combined with either of the above
+      - use-cases can be combined, the nd2 file is read once for all of them
       - roi_file is optional for all use-cases
     """
     validate_args(gui, input_file, roi_file, matlab_output_dir, piv_params_file, calibration_file,
-                  z_axis_profile_output_dir, z_axis_profile_single_output_file, z_axis_profile_plot, output_dir)
+                  z_axis_profile_output_dir, z_axis_profile_single_output_file, z_axis_profile_plot, output_dir,
+                  tiff_output_mode, tiff_contiguous, tiff_compression, tiff_tile, zarr_output_dir, zarr_chunks,
+                  headless, checkpoint, resume, z_axis_profile_stats, tiff_compression_level, tiff_predictor)
 
     arguments = Arguments.instance()
 
@@ -122,18 +228,42 @@ def cli(gui, input_file, multipoints, channels, parallel, roi_file, output_dir,
         calibration_file=calibration_file,
         z_axis_profile_output_dir=z_axis_profile_output_dir,
         z_axis_profile_single_output_file=z_axis_profile_single_output_file,
-        z_axis_profile_plot=z_axis_profile_plot
+        z_axis_profile_plot=z_axis_profile_plot,
+        reader_backend=reader_backend,
+        tiff_output_mode=tiff_output_mode,
+        tiff_contiguous=tiff_contiguous,
+        writer_threads=writer_threads,
+        tiff_compression=tiff_compression,
+        tiff_compression_level=tiff_compression_level,
+        tiff_predictor=tiff_predictor,
+        tiff_tile=tiff_tile,
+        tiff_compression_workers=tiff_compression_workers,
+        zarr_output_dir=zarr_output_dir,
+        zarr_chunks=zarr_chunks,
+        zarr_compressor=zarr_compressor,
+        z_axis_profile_stats=z_axis_profile_stats,
+        piv_engine=piv_engine,
+        piv_output_format=piv_output_format,
+        resume=resume,
+        checkpoint=checkpoint,
+        timepoints=timepoints,
+        piv_pair_gap=piv_pair_gap,
+        headless=headless
     )
 
     # Your pipeline logic here (or call run_pipeline(Arguments.instance()))
     if arguments.is_gui():
+        from gui.main_window import MainWindow
         main_window = MainWindow("ND2TiffExporter")
         main_window.start()
 
+    # orchestrators load the reading and writing libraries, imported once the arguments are valid
     orchestrator = None
     if arguments.parallel:
+        from works.multi_process_orchestrator import MultiProcessOrchestrator
         orchestrator = MultiProcessOrchestrator()
     else:
+        from works.single_process_orchestrator import SingleProcessOrchestrator
         orchestrator = SingleProcessOrchestrator()
     orchestrator.run()
 
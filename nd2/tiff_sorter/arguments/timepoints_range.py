@@ -0,0 +1,19 @@
+import click
+
+
+class TimepointsRange(click.ParamType):
+    name = "start:stop:step"
+
+    def convert(self, value, param, ctx):
+        # --timepoints=100:200 --timepoints=::5 --timepoints=10::2, python slice of the time axis
+        parts = value.strip().split(':')
+        if len(parts) not in [2, 3]:
+            self.fail(f"'{value}' is not start:stop or start:stop:step", param, ctx)
+        res = None
+        try:
+            res = [int(part) if part.strip() else None for part in parts]
+        except ValueError:
+            self.fail(f"'{value}' start, stop and step must be integers", param, ctx)
+        if len(res) == 3 and res[2] is not None and res[2] < 1:
+            self.fail(f"'{value}' step must be a positive integer", param, ctx)
+        return res
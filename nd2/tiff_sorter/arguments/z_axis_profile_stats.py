@@ -0,0 +1,18 @@
+import click
+import re
+
+Z_AXIS_PROFILE_STATS = ['mean', 'std', 'min', 'max', 'sum']
+
+
+class ZAxisProfileStats(click.ParamType):
+    name = "stats_list"
+
+    def convert(self, value, param, ctx):
+        # --z_axis_profile_stats=std,min,max,p5,p95
+        res = [stat.strip().lower() for stat in value.strip().strip('[]').split(',') if stat.strip()]
+        for stat in res:
+            percentile = re.fullmatch(r'p(\d+(\.\d+)?)', stat)
+            if stat not in Z_AXIS_PROFILE_STATS and (percentile is None or float(percentile.group(1)) > 100):
+                self.fail(f"'{stat}' is not one of {', '.join(Z_AXIS_PROFILE_STATS)} or a percentile p0..p100",
+                          param, ctx)
+        return res
@@ -1,22 +1,31 @@
 import io
 import csv
-from nd2_tools.nd2_wrapper import ND2Wrapper
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
 from arguments.arguments import Arguments
 
 
-def generate_z_profile_csv(mean_values, experiment_interval_sec):
+def get_stat_title(stat):
+    return stat.upper() if stat.startswith('p') else stat.capitalize()
+
+
+def generate_z_profile_csv(mean_values, experiment_interval_sec, stats_values=None):
+    """stats_values: {stat: per frame values} written as additional columns of a single series file"""
     arguments = Arguments.instance()
+    nd2_wrapper = get_nd2_wrapper(arguments.input_file, arguments.reader_backend)
+    # values are given for the processed timepoints only
+    timepoints = arguments.get_timepoints_range(nd2_wrapper.get_timepoints())
     buffer = io.StringIO()
     writer = csv.writer(buffer)
     writer.writerow(["input file"])
     writer.writerow([arguments.input_file])
     writer.writerow([])
     if arguments.z_axis_profile_single_output_file is False:
-        writer.writerow(["[sec]", "Mean"])
+        stats_values = {} if stats_values is None else stats_values
+        writer.writerow(["[sec]", "Mean"] + [get_stat_title(stat) for stat in stats_values.keys()])
         for i, mean in enumerate(mean_values):
-            writer.writerow([i * experiment_interval_sec, mean])
+            writer.writerow([timepoints[i] * experiment_interval_sec, mean] +
+                            [values[i] for values in stats_values.values()])
     else:
-        nd2_wrapper = ND2Wrapper.instance(arguments.input_file)
         multipoints = nd2_wrapper.get_multipoints_number()
         channels = nd2_wrapper.get_channels_number()
         channel_names = nd2_wrapper.get_channel_names()
@@ -25,8 +34,8 @@ def generate_z_profile_csv(mean_values, experiment_interval_sec):
             for channel in range(channels):
                 titles.append(f"{multipoint}\\{channel_names[channel]}")
         writer.writerow(titles)
-        for i in range(nd2_wrapper.get_timepoints()):
-            row = [i*experiment_interval_sec]
+        for i, timepoint in enumerate(timepoints):
+            row = [timepoint*experiment_interval_sec]
             for multipoint in range(multipoints):
                 for channel in range(channels):
                     key = f"{multipoint}_{channel}"
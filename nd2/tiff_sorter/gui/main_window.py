@@ -6,14 +6,14 @@ from tkinterdnd2 import DND_FILES, TkinterDnD
 import os
 from config.settings import Settings
 from pathlib import Path
-from nd2_tools.nd2_wrapper import ND2Wrapper
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
+from arguments.arguments import Arguments
 from tkinter import ttk
 import matplotlib.pyplot as plt
 import numpy as np
 from matplotlib.widgets import RectangleSelector
 from functools import partial
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from nd2_tools.nd2_wrapper import ND2Wrapper
 
 
 def manual_blending(current_images, vmin, vmax):
@@ -105,7 +105,7 @@ class MainWindow:
         Settings.instance().set('input_file', self.input_file.get())
 
         if self.roi.get() == 1:
-            images = ND2Wrapper(self.input_file.get())
+            images = get_nd2_wrapper(self.input_file.get(), Arguments.instance().reader_backend)
             first_images = images.get_first_images()
             for key in first_images.keys():
                 first_images[key].show()
@@ -436,7 +436,7 @@ class MainWindow:
         if visible:
             self.add_images_frame()
             self.add_image_selection_controls()
-            self.images = ND2Wrapper.instance(self.input_file)
+            self.images = get_nd2_wrapper(self.input_file, Arguments.instance().reader_backend)
             self.add_first_images()
         else:
             if self.images_frame is not None:
@@ -4,11 +4,13 @@ import queue
 
 
 class ProgressWindow:
-    def __init__(self, data, order, queue):
+    def __init__(self, data, order, queue, progress_counters=None):
+        """queue passes progress titles and 'Quit', progress_counters (ProgressCounters) are read on every poll"""
         self.root = None
         self.data = data
         self.order = order
         self.queue = queue
+        self.progress_counters = progress_counters
         self.progress_bars = {}
         self.progress_bar_frame = None
         self.aborted = False
@@ -31,14 +33,11 @@ class ProgressWindow:
             index += 1
         self.progress_bar_frame.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-    def inc(self, title):
+    def inc(self, title, count=1):
         progress_entry = self.progress_bars[title]
-        progress_entry['counter'] += 1
+        progress_entry['counter'] += count
         progress_bar = progress_entry['progress_bar']
-        if progress_entry['counter'] != self.data[title]['maximum']:
-            progress_bar.step()
-        else:
-            progress_bar['value'] = progress_bar['maximum']
+        progress_bar['value'] = min(progress_entry['counter'], self.data[title]['maximum'])
         progress_entry['units'].config(text=f"{progress_entry['counter']}/{self.data[title]['maximum']} {self.data[title]['units']}")
 
     def poll_queue(self):
@@ -52,6 +51,10 @@ class ProgressWindow:
                     self.inc(msg)
             except queue.Empty:
                 break
+        if self.progress_counters is not None:
+            for title, counter in self.progress_counters.get_totals().items():
+                if title in self.progress_bars and counter != self.progress_bars[title]['counter']:
+                    self.inc(title, counter - self.progress_bars[title]['counter'])
         self.root.after(100, self.poll_queue)
 
     def on_close(self):
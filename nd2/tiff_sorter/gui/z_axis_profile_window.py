@@ -4,7 +4,8 @@ from tkinter import ttk
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 import numpy as np
-from nd2_tools.nd2_wrapper import ND2Wrapper
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
+from arguments.arguments import Arguments
 
 
 class ZAxisProfileWindow:
@@ -49,8 +50,9 @@ class ZAxisProfileWindow:
         self.root.title("Z-axis Intensity Profiles")
         self.root.geometry("800x500")
         experiment_interval_seconds = get_experiment_interval_ms(self.input_file) / 1000.0
-        times = np.arange(len(self.mean_results[0]['mean_results']))*experiment_interval_seconds
-        nd2_wrapper = ND2Wrapper.instance(self.input_file)
+        nd2_wrapper = get_nd2_wrapper(self.input_file, Arguments.instance().reader_backend)
+        timepoints = Arguments.instance().get_timepoints_range(nd2_wrapper.get_timepoints())
+        times = np.array(timepoints)*experiment_interval_seconds
         channel_names = nd2_wrapper.get_channel_names()
         values_to_plot = []
         for mean_result in self.mean_results:
@@ -0,0 +1,25 @@
+function piv_params = convert_pivlab_params(piv_params)
+    % Convert all numeric params to double (Python passes integers as int64)
+    piv_params.clahe = double(piv_params.clahe);
+    piv_params.clahesize = double(piv_params.clahesize);
+    piv_params.highp = double(piv_params.highp);
+    piv_params.highpsize = double(piv_params.highpsize);
+    piv_params.intenscap = double(piv_params.intenscap);
+    piv_params.wienerwurst = double(piv_params.wienerwurst);
+    piv_params.wienerwurstsize = double(piv_params.wienerwurstsize);
+    piv_params.minintens = double(piv_params.minintens);
+    piv_params.maxintens = double(piv_params.maxintens);
+    piv_params.interrogationarea = double(piv_params.interrogationarea);
+    piv_params.step = double(piv_params.step);
+    piv_params.subpixfinder = double(piv_params.subpixfinder);
+    piv_params.passes = double(piv_params.passes);
+    piv_params.int2 = double(piv_params.int2);
+    piv_params.int3 = double(piv_params.int3);
+    piv_params.int4 = double(piv_params.int4);
+    piv_params.repeat = double(piv_params.repeat);
+    piv_params.mask_auto = double(piv_params.mask_auto);
+    piv_params.do_linear_correlation = double(piv_params.do_linear_correlation);
+    piv_params.repeat_last_pass = double(piv_params.repeat_last_pass);
+    piv_params.delta_diff_min = double(piv_params.delta_diff_min);
+    piv_params.cal_fact = double(piv_params.cal_fact);
+end
@@ -0,0 +1,130 @@
+# mat_v73_writer.py
+"""
+Streams PIV results into a MATLAB v7.3 (HDF5) .mat file, pair by pair.
+
+Fields of every pair are appended to chunked datasets, MATLAB loads them as rows x cols x pairs arrays
+(u(:, :, k) is the field of pair k), x and y hold the grid shared by all pairs and mean_velocity,
+max_velocity and pair_indices are 1 x pairs vectors. Memory use doesn't depend on the series length.
+The file is written as <output_file>.partial and renamed once complete, an interrupted series is resumed by
+reopening the partial file.
+"""
+
+import os
+import sys
+import time
+import h5py
+import numpy as np
+
+FIELDS = ['u', 'v', 'typevector', 'velocity_magnitude']
+VECTORS = ['mean_velocity', 'max_velocity', 'pair_indices']
+
+
+def write_mat_v73_header(output_file):
+    """MATLAB identifies v7.3 files by the 128 bytes header in the HDF5 user block"""
+    platform = {'win32': 'PCWIN64', 'darwin': 'MACI64'}.get(sys.platform, 'GLNXA64')
+    text = (f"MATLAB 7.3 MAT-file, Platform: {platform}, Created on: {time.strftime('%a %b %d %H:%M:%S %Y')} "
+            f"HDF5 schema 1.00 .")
+    header = text.encode('ascii').ljust(116, b' ') + b' ' * 8 + b'\x00\x02' + b'IM'
+    with open(output_file, 'r+b') as f:
+        f.write(header)
+
+
+def read_mat_v73_results(input_file):
+    """Yields the pairs of a file written by MatV73Writer as result dicts"""
+    with h5py.File(input_file, 'r') as f:
+        pairs = int(f['num_pairs'][0, 0])
+        x = f['x'][()].T if pairs > 0 else None
+        y = f['y'][()].T if pairs > 0 else None
+        for pair in range(pairs):
+            res = {'x': x, 'y': y, 'pair_index': int(f['pair_indices'][pair, 0]),
+                   'mean_velocity': f['mean_velocity'][pair, 0], 'max_velocity': f['max_velocity'][pair, 0]}
+            for field in FIELDS:
+                res[field] = f[field][pair].T
+            yield res
+
+
+def merge_mat_v73_files(input_files, output_file, pairs):
+    """Appends the pairs of input_files, in order, to a single file"""
+    writer = MatV73Writer(output_file, pairs)
+    for input_file in input_files:
+        for result in read_mat_v73_results(input_file):
+            writer.append(result)
+    writer.close()
+
+
+class MatV73Writer:
+
+    def __init__(self, output_file, pairs, resume_pairs=0):
+        """
+        pairs: expected number of pairs, datasets are preallocated and trimmed on close
+        resume_pairs: pairs of the partial file kept, the following are overwritten
+        """
+        self.output_file = output_file
+        self.partial_file = output_file + '.partial'
+        self.pairs = pairs
+        self.written_pairs = 0
+        self.datasets = {}
+        if resume_pairs > 0:
+            if not os.path.isfile(self.partial_file) and os.path.isfile(output_file):
+                # the previous run completed and renamed the file before recording the series as done
+                os.replace(output_file, self.partial_file)
+            self.file = h5py.File(self.partial_file, 'r+')
+            if 'num_pairs' in self.file:
+                del self.file['num_pairs']
+            self.datasets = {name: self.file[name] for name in ['x', 'y'] + FIELDS + VECTORS}
+            self.written_pairs = resume_pairs
+        else:
+            self.file = h5py.File(self.partial_file, 'w', userblock_size=512)
+
+    def create_dataset(self, name, shape, maxshape, chunks=None):
+        dataset = self.file.create_dataset(name, shape=shape, maxshape=maxshape, chunks=chunks, dtype=np.float64)
+        dataset.attrs['MATLAB_class'] = np.bytes_('double')
+        self.datasets[name] = dataset
+
+    def write_matrix(self, name, matrix):
+        # MATLAB is column-major, HDF5 dimensions are stored reversed
+        self.create_dataset(name, matrix.T.shape, matrix.T.shape)
+        self.datasets[name][...] = matrix.T
+
+    def create_datasets(self, result):
+        rows, cols = np.shape(result['u'])
+        self.write_matrix('x', np.asarray(result['x'], dtype=np.float64))
+        self.write_matrix('y', np.asarray(result['y'], dtype=np.float64))
+        for field in FIELDS:
+            self.create_dataset(field, (self.pairs, cols, rows), (None, cols, rows), chunks=(1, cols, rows))
+        for vector in VECTORS:
+            self.create_dataset(vector, (self.pairs, 1), (None, 1), chunks=(1024, 1))
+
+    def append(self, result):
+        if 'u' not in self.datasets:
+            self.create_datasets(result)
+        pair = self.written_pairs
+        if pair >= len(self.datasets['u']):
+            for name in FIELDS + VECTORS:
+                self.datasets[name].resize(pair + 1, axis=0)
+        for field in FIELDS:
+            self.datasets[field][pair] = np.asarray(result[field], dtype=np.float64).T
+        self.datasets['mean_velocity'][pair, 0] = result['mean_velocity']
+        self.datasets['max_velocity'][pair, 0] = result['max_velocity']
+        self.datasets['pair_indices'][pair, 0] = result['pair_index']
+        self.written_pairs += 1
+        # what was written survives a crash of the run
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None and self.written_pairs < self.pairs:
+            # interrupted series, the partial file is kept for a resumed run
+            self.file.close()
+            self.file = None
+        if self.file is not None:
+            for name in FIELDS + VECTORS:
+                if name in self.datasets:
+                    self.datasets[name].resize(self.written_pairs, axis=0)
+            num_pairs = self.file.create_dataset('num_pairs', data=np.array([[self.written_pairs]], dtype=np.float64))
+            num_pairs.attrs['MATLAB_class'] = np.bytes_('double')
+            self.file.close()
+            self.file = None
+            write_mat_v73_header(self.partial_file)
+            os.replace(self.partial_file, self.output_file)
+            print(f"Results saved to {self.output_file}")
+            print(f"  {self.written_pairs} velocity fields")
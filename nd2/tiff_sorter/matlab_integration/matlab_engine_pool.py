@@ -0,0 +1,137 @@
+# matlab_engine_pool.py
+"""
+Long lived, shared MATLAB engines.
+
+Engines run as separate MATLAB processes named <prefix>_<slot> (matlab.engine.shareEngine), so they
+survive the worker processes and the run that started them. Workers connect to the engine of their
+slot with matlab.engine.connect_matlab, engine startup is paid once per machine.
+
+usage (from tiff_sorter directory):
+    python -m matlab_integration.matlab_engine_pool start|status|stop
+"""
+
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+import matlab.engine
+from config.settings import Settings
+
+
+class MatlabEnginePool:
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self):
+        settings = Settings.instance()
+        pool_size = settings.get('matlab_engine_pool_size')
+        self.pool_size = os.cpu_count() if pool_size is None else int(pool_size)
+        prefix = settings.get('matlab_engine_name_prefix')
+        self.prefix = 'bio_imaging_tools' if prefix is None else prefix
+        executable = settings.get('matlab_executable')
+        self.executable = 'matlab' if executable is None else executable
+        start_timeout = settings.get('matlab_engine_start_timeout')
+        self.start_timeout = 180 if start_timeout is None else float(start_timeout)
+
+    def get_engine_name(self, slot):
+        return f"{self.prefix}_{slot % self.pool_size}"
+
+    def get_running_engines(self):
+        return [name for name in matlab.engine.find_matlab() if name.startswith(self.prefix + '_')]
+
+    def add_paths(self, eng):
+        eng.addpath(str(Path(__file__).parent.absolute()), nargout=0)
+        eng.addpath(Settings.instance().get('pivlab_root'), nargout=0)
+
+    def is_healthy(self, eng):
+        """The engine answers and process_single_pair_pivlab is on its path"""
+        res = False
+        try:
+            res = eng.exist('process_single_pair_pivlab', nargout=1) == 2
+        except (matlab.engine.EngineError, matlab.engine.MatlabExecutionError, SystemError):
+            pass
+        return res
+
+    def launch(self, name):
+        """Starts a detached MATLAB process sharing its engine as name, returns once it can be connected"""
+        print(f"Starting shared MATLAB engine {name}...")
+        deadline = time.time() + self.start_timeout
+        # a stopped engine releases its name asynchronously
+        while name in matlab.engine.find_matlab():
+            if time.time() > deadline:
+                raise TimeoutError(f"MATLAB engine {name} is not responding and didn't exit")
+            time.sleep(1)
+        # -r returns once the engine is shared, the idle loop keeps MATLAB running (a command line MATLAB would
+        # otherwise read the end of its stdin and exit), engine requests are served while it pauses
+        command = [self.executable, '-nosplash', '-nodesktop', '-r',
+                   f"matlab.engine.shareEngine('{name}'); while true, pause(3600); end"]
+        if sys.platform == 'win32':
+            command.insert(1, '-minimize')
+            subprocess.Popen(command, creationflags=subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP)
+        else:
+            subprocess.Popen(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, start_new_session=True)
+        while name not in matlab.engine.find_matlab():
+            if time.time() > deadline:
+                raise TimeoutError(f"MATLAB engine {name} didn't start within {self.start_timeout} seconds")
+            time.sleep(1)
+
+    def connect(self, slot):
+        """
+        Returns an engine connected to the shared session of slot, launching it when it isn't running
+        or doesn't answer. Returns [engine, started] - started is True when the session was launched.
+        """
+        name = self.get_engine_name(slot)
+        eng = None
+        started = False
+        if name in matlab.engine.find_matlab():
+            try:
+                eng = matlab.engine.connect_matlab(name)
+            except matlab.engine.EngineError:
+                eng = None
+            if eng is not None and not self.is_healthy(eng):
+                # running but stale path (e.g. pivlab_root changed) - fix the path before giving up on it
+                try:
+                    self.add_paths(eng)
+                except (matlab.engine.EngineError, SystemError):
+                    eng = None
+                if eng is not None and not self.is_healthy(eng):
+                    self.stop_engine(eng, name)
+                    eng = None
+        if eng is None:
+            self.launch(name)
+            eng = matlab.engine.connect_matlab(name)
+            self.add_paths(eng)
+            started = True
+        return [eng, started]
+
+    def start(self):
+        for slot in range(self.pool_size):
+            self.connect(slot)[0].quit()
+
+    def stop_engine(self, eng, name):
+        # exit the shared MATLAB process, quit() would only disconnect from it
+        try:
+            eng.eval('exit', nargout=0)
+        except (matlab.engine.EngineError, SystemError):
+            pass
+        print(f"MATLAB engine {name} stopped")
+
+    def stop(self):
+        for name in self.get_running_engines():
+            self.stop_engine(matlab.engine.connect_matlab(name), name)
+
+
+if __name__ == '__main__':
+    pool = MatlabEnginePool.instance()
+    action = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    if action == 'start':
+        pool.start()
+    elif action == 'stop':
+        pool.stop()
+    print(f"Running MATLAB engines: {pool.get_running_engines()}")
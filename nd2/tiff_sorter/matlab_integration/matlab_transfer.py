@@ -0,0 +1,56 @@
+# matlab_transfer.py
+"""
+numpy <-> MATLAB array conversion without intermediate Python lists.
+
+MATLAB engines of R2022a and later build matlab arrays from objects supporting the buffer protocol and
+expose their data through it. Older engines fall back to the nested list initializer and to the
+array.array holding the data of a matlab array.
+"""
+
+import numpy as np
+import matlab
+
+_buffer_protocol_supported = None
+
+
+def is_buffer_protocol_supported():
+    global _buffer_protocol_supported
+    if _buffer_protocol_supported is None:
+        try:
+            probe = np.arange(6, dtype=np.uint16).reshape((2, 3), order='F')
+            matlab_probe = matlab.uint16(probe)
+            _buffer_protocol_supported = np.array_equal(np.asarray(memoryview(matlab_probe)), probe)
+        except (TypeError, ValueError):
+            _buffer_protocol_supported = False
+    return _buffer_protocol_supported
+
+
+def stack_frames(frames, dtype=np.uint16):
+    """rows x cols x frames block in MATLAB (Fortran) order, a single copy of every frame"""
+    res = np.empty(frames[0].shape + (len(frames),), dtype=dtype, order='F')
+    for index, frame in enumerate(frames):
+        res[:, :, index] = frame
+    return res
+
+
+def numpy_to_matlab(np_array, matlab_type=matlab.uint16, dtype=np.uint16):
+    """The array is converted to dtype only when needed and laid out in Fortran order, as MATLAB stores it"""
+    np_array = np.asfortranarray(np_array, dtype=dtype)
+    res = None
+    if is_buffer_protocol_supported():
+        res = matlab_type(np_array)
+    else:
+        res = matlab_type(np_array.tolist())
+    return res
+
+
+def matlab_to_numpy(value):
+    """matlab array to numpy array, Python scalars returned by the engine are passed through np.asarray"""
+    res = None
+    if isinstance(value, (bool, int, float)):
+        res = np.asarray(value)
+    elif is_buffer_protocol_supported():
+        res = np.asarray(memoryview(value))
+    else:
+        res = np.asarray(value._data).reshape(value.size, order='F')
+    return res
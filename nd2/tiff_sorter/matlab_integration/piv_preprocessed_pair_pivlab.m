@@ -0,0 +1,39 @@
+function result = piv_preprocessed_pair_pivlab(image1, image2, piv_params)
+    % PIV of two frames preprocessed by preprocess_pivlab_frame, piv_params converted by convert_pivlab_params
+    % PIV computation
+    [x, y, u, v, typevector, corr_map, ~] = piv.piv_FFTmulti(image1, image2, ...
+        piv_params.interrogationarea, ...
+        piv_params.step, ...
+        piv_params.subpixfinder, ...
+        [], [], ...
+        piv_params.passes, ...
+        piv_params.int2, ...
+        piv_params.int3, ...
+        piv_params.int4, ...
+        piv_params.imdeform, ...
+        piv_params.repeat, ...
+        piv_params.mask_auto, ...
+        piv_params.do_linear_correlation, ...
+        0, ...
+        piv_params.repeat_last_pass, ...
+        piv_params.delta_diff_min);
+
+    % Package results
+    result = struct();
+    result.x = x;
+    result.y = y;
+    result.u = u;
+    result.v = v;
+    result.typevector = typevector;
+    result.correlation_map = corr_map;
+
+    vel_mag = sqrt(u.^2 + v.^2);
+    result.velocity_magnitude = vel_mag;
+    result.mean_velocity = mean(vel_mag(:), 'omitnan');
+    result.max_velocity = max(vel_mag(:));
+
+    % Apply calibration
+    result.u_calibrated = u * piv_params.cal_fact;
+    result.v_calibrated = v * piv_params.cal_fact;
+    result.velocity_magnitude_calibrated = sqrt(result.u_calibrated.^2 + result.v_calibrated.^2);
+end
\ No newline at end of file
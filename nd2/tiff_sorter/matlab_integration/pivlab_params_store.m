@@ -0,0 +1,29 @@
+function piv_params = pivlab_params_store(action, params_key, piv_params)
+    % Converted PIV params kept in the engine, so calls of a series pass params_key instead of the struct
+    % action: 'set' converts (convert_pivlab_params) and stores piv_params, 'get' returns them,
+    %         'remove' releases them, 'remove_prefix' releases the params of all keys starting with params_key
+    persistent stored_params
+    if isempty(stored_params)
+        stored_params = containers.Map();
+    end
+
+    switch action
+        case 'set'
+            piv_params = convert_pivlab_params(piv_params);
+            stored_params(params_key) = piv_params;
+        case 'get'
+            piv_params = stored_params(params_key);
+        case 'remove'
+            if isKey(stored_params, params_key)
+                remove(stored_params, params_key);
+            end
+            piv_params = struct();
+        case 'remove_prefix'
+            params_keys = keys(stored_params);
+            removed = params_keys(startsWith(params_keys, params_key));
+            if ~isempty(removed)
+                remove(stored_params, removed);
+            end
+            piv_params = struct();
+    end
+end
@@ -0,0 +1,9 @@
+function image = preprocess_pivlab_frame(image, piv_params)
+    % piv_params converted by convert_pivlab_params
+    image = preproc.PIVlab_preproc(image, [], ...
+        piv_params.clahe, piv_params.clahesize, ...
+        piv_params.highp, piv_params.highpsize, ...
+        piv_params.intenscap, ...
+        piv_params.wienerwurst, piv_params.wienerwurstsize, ...
+        piv_params.minintens, piv_params.maxintens);
+end
@@ -0,0 +1,46 @@
+function result = process_series_frames_pivlab(series_key, images, action)
+    % Streams the frames of a series: images is a rows x cols x N block of the next N frames.
+    % The preprocessed last frame stays in the engine keyed by series_key and pairs with the first
+    % frame of the next call, so every frame is sent and preprocessed once.
+    % Returns the stacked results (see stack_pivlab_results) of N pairs, N-1 on the first call.
+    % PIV params of the series are stored once with pivlab_params_store('set', series_key, piv_params).
+    % An empty images block ends the series and releases its frame and params.
+    % action 'release_prefix' releases the frames and params of every series whose key starts with series_key,
+    % e.g. the series a worker process left behind when it was aborted.
+    persistent previous_frames
+    if isempty(previous_frames)
+        previous_frames = containers.Map();
+    end
+
+    result = struct();
+    if nargin > 2 && strcmp(action, 'release_prefix')
+        series_keys = keys(previous_frames);
+        released = series_keys(startsWith(series_keys, series_key));
+        if ~isempty(released)
+            remove(previous_frames, released);
+        end
+        pivlab_params_store('remove_prefix', series_key);
+        return;
+    end
+    if isempty(images)
+        if isKey(previous_frames, series_key)
+            remove(previous_frames, series_key);
+        end
+        pivlab_params_store('remove', series_key);
+        return;
+    end
+
+    piv_params = pivlab_params_store('get', series_key);
+    frames = size(images, 3);
+    preprocessed = cell(1, frames);
+    for frame = 1:frames
+        preprocessed{frame} = preprocess_pivlab_frame(images(:, :, frame), piv_params);
+    end
+    if isKey(previous_frames, series_key)
+        preprocessed = [{previous_frames(series_key)}, preprocessed];
+    end
+    previous_frames(series_key) = preprocessed{end};
+    if numel(preprocessed) > 1
+        result = stack_pivlab_results(preprocessed, piv_params);
+    end
+end
@@ -5,10 +5,12 @@ Memory-efficient PIVlab processing - process frame pairs one at a time
 
 import matlab.engine
 import numpy as np
+import os
 import time
-from pathlib import Path
-from config.settings import Settings
 from profiling.profiler import Profiler
+from matlab_integration.matlab_engine_pool import MatlabEnginePool
+from matlab_integration.matlab_transfer import numpy_to_matlab, matlab_to_numpy, stack_frames
+from piv_tools.piv_params import validate_piv_params
 
 class PIVlabStreamProcessor:
     """
@@ -16,33 +18,42 @@ class PIVlabStreamProcessor:
     Only 2 frames in memory at a time
     """
     
-    def __init__(self, report_strategy):
+    def __init__(self, report_strategy, engine_slot=0):
+        """engine_slot: shared engine of the MatlabEnginePool used by this processor, one per worker"""
         self.eng = None
         self.report_strategy = report_strategy
+        self.engine_slot = engine_slot
+        # last converted params, pairs of a series share the same dict
+        self.matlab_params_source = None
+        self.matlab_params = None
         
     def start_matlab(self):
-        """Start MATLAB engine"""
+        """Connect to the shared MATLAB engine of engine_slot, starting it if needed"""
         if self.eng is None:
-            print("Starting MATLAB engine...")
             matlab_start = time.time()
-            self.eng = matlab.engine.start_matlab()
-            Profiler.instance().inc('matlab_start',  time.time()-matlab_start)
-            print("✓ MATLAB engine started")
-            matlab_add_path = time.time()
-            current_dir = str(Path(__file__).parent.absolute())
-            self.eng.addpath(current_dir, nargout=0)
-            pivlab_root = Settings.instance().get('pivlab_root')
-            self.eng.addpath(pivlab_root)
-            Profiler.instance().inc('matlab_add_path', time.time()-matlab_add_path)
+            [self.eng, started] = MatlabEnginePool.instance().connect(self.engine_slot)
+            self.release_process_series()
+            # matlab_start counts launching engines only, connecting to a running one is matlab_add_path
+            Profiler.instance().inc('matlab_start' if started else 'matlab_add_path', time.time()-matlab_start)
+            print("✓ MATLAB engine connected")
         
         return self.eng
     
     def stop_matlab(self):
-        """Stop MATLAB engine"""
+        """Disconnect from the shared MATLAB engine, the engine keeps running for the next workers and runs"""
         if self.eng is not None:
-            self.eng.quit()
-            self.eng = None
-            print("MATLAB engine stopped")
+            try:
+                self.release_process_series()
+            finally:
+                self.eng.quit()
+                self.eng = None
+
+    def release_process_series(self):
+        """
+        Release the frames and params the shared engine keeps for the series of this process (series keys start
+        with the process id, see ND2Worker.prepare_consumers), left behind when a series was aborted
+        """
+        self.eng.process_series_frames_pivlab(f"{os.getpid()}_", matlab.uint16([]), 'release_prefix', nargout=1)
     
     def process_frame_pair(self, img1, img2, piv_params):
         """
@@ -84,7 +95,7 @@ class PIVlabStreamProcessor:
                 'stdev_threshold': 5
             }
         
-        matlab_params = self._dict_to_matlab_struct(piv_params)
+        matlab_params = self._get_matlab_params(piv_params)
 
         t3 = time.time()
 
@@ -100,17 +111,17 @@ class PIVlabStreamProcessor:
         
         # Convert back to Python
         result = {
-            'x': np.array(matlab_result['x']),
-            'y': np.array(matlab_result['y']),
-            'u': np.array(matlab_result['u']),
-            'v': np.array(matlab_result['v']),
-            'typevector': np.array(matlab_result['typevector']),
-            'velocity_magnitude': np.array(matlab_result['velocity_magnitude']),
+            'x': matlab_to_numpy(matlab_result['x']),
+            'y': matlab_to_numpy(matlab_result['y']),
+            'u': matlab_to_numpy(matlab_result['u']),
+            'v': matlab_to_numpy(matlab_result['v']),
+            'typevector': matlab_to_numpy(matlab_result['typevector']),
+            'velocity_magnitude': matlab_to_numpy(matlab_result['velocity_magnitude']),
             'mean_velocity': float(matlab_result['mean_velocity']),
             'max_velocity': float(matlab_result['max_velocity']),
-            'u_calibrated': np.array(matlab_result['u_calibrated']),
-            'v_calibrated': np.array(matlab_result['v_calibrated']),
-            'velocity_magnitude_calibrated': np.array(matlab_result['velocity_magnitude_calibrated']),
+            'u_calibrated': matlab_to_numpy(matlab_result['u_calibrated']),
+            'v_calibrated': matlab_to_numpy(matlab_result['v_calibrated']),
+            'velocity_magnitude_calibrated': matlab_to_numpy(matlab_result['velocity_magnitude_calibrated']),
         }
 
         t5 = time.time()
@@ -121,6 +132,62 @@ class PIVlabStreamProcessor:
         Profiler.instance().inc('convert_back_to_python', t5 - t4)
         return result
     
+    def start_series(self, series_key, piv_params):
+        """Validate and convert the PIV params of a series once, MATLAB keeps them under series_key"""
+        if self.eng is None:
+            self.start_matlab()
+
+        validate_piv_params(piv_params)
+        t1 = time.time()
+        self.eng.pivlab_params_store('set', series_key, self._dict_to_matlab_struct(piv_params), nargout=1)
+        Profiler.instance().inc('dict_to_matlab_struct', time.time() - t1)
+
+    def process_series_frames(self, series_key, frames, pairs):
+        """
+        Send the next frames of a series started by start_series, MATLAB keeps the preprocessed last frame
+        of the previous call (see process_series_frames_pivlab.m) so every frame is transferred and
+        preprocessed once
+
+        Parameters:
+        -----------
+        series_key : str
+            Unique name of the series in the engine
+        frames : list of ndarray
+            2D numpy arrays (consecutive frames)
+        pairs : int
+            len(frames) - 1 on the first call of the series, len(frames) on later calls
+
+        Returns:
+        --------
+        list of dict : PIV results of the pairs, same fields as process_frame_pair
+        """
+
+        if self.eng is None:
+            self.start_matlab()
+
+        t1 = time.time()
+        matlab_images = self._numpy_to_matlab(stack_frames(frames))
+
+        t2 = time.time()
+
+        matlab_result = self.eng.process_series_frames_pivlab(series_key, matlab_images, nargout=1)
+
+        t3 = time.time()
+
+        results = self._stacked_results_to_python(matlab_result, pairs)
+
+        t4 = time.time()
+
+        Profiler.instance().inc('convert_to_matlab_format', t2-t1)
+        Profiler.instance().inc('process_series_frames_pivlab', t3 - t2)
+        Profiler.instance().inc('convert_back_to_python', t4 - t3)
+        return results
+
+    def end_series(self, series_key):
+        """Release the frame and params MATLAB keeps for series_key"""
+        if self.eng is not None:
+            self.eng.process_series_frames_pivlab(series_key, matlab.uint16([]), nargout=1)
+
     def process_image_generator(self, image_generator, piv_params, report_strategy):
         """
         Process images from a generator (memory efficient!)
@@ -167,12 +234,40 @@ class PIVlabStreamProcessor:
         
         # print(f"Processed {pair_count} pairs from {frame_count} frames")
 
+    def _stacked_results_to_python(self, matlab_result, pairs):
+        """Split results stacked along the 3rd dimension (see stack_pivlab_results.m) into per pair dicts"""
+        results = []
+        if pairs > 0:
+            x = matlab_to_numpy(matlab_result['x'])
+            y = matlab_to_numpy(matlab_result['y'])
+            # MATLAB drops the trailing dimension of a single pair
+            stacked = {}
+            for field in ['u', 'v', 'typevector', 'velocity_magnitude', 'u_calibrated', 'v_calibrated',
+                          'velocity_magnitude_calibrated']:
+                values = matlab_to_numpy(matlab_result[field])
+                stacked[field] = values.reshape(values.shape[:2] + (pairs,))
+            mean_velocity = np.ravel(matlab_to_numpy(matlab_result['mean_velocity']))
+            max_velocity = np.ravel(matlab_to_numpy(matlab_result['max_velocity']))
+            for pair in range(pairs):
+                result = {'x': x, 'y': y}
+                for field, values in stacked.items():
+                    result[field] = values[:, :, pair]
+                result['mean_velocity'] = float(mean_velocity[pair])
+                result['max_velocity'] = float(max_velocity[pair])
+                results.append(result)
+        return results
+
     def _numpy_to_matlab(self, np_array):
-        """Convert numpy 2D array to MATLAB uint16 array"""
-        if np_array.dtype != np.uint16:
-            np_array = np_array.astype(np.uint16)
-        return matlab.uint16(np_array)
+        """Convert numpy 2D / 3D array to MATLAB uint16 array"""
+        return numpy_to_matlab(np_array)
     
+    def _get_matlab_params(self, piv_params):
+        """Convert piv_params once, as long as the same dict is passed"""
+        if self.matlab_params_source is not piv_params:
+            self.matlab_params = self._dict_to_matlab_struct(piv_params)
+            self.matlab_params_source = piv_params
+        return self.matlab_params
+
     def _dict_to_matlab_struct(self, py_dict):
         """Convert Python dict to MATLAB struct"""
         struct_dict = {}
@@ -183,6 +278,9 @@ class PIVlabStreamProcessor:
                 struct_dict[key] = value
         return struct_dict
     
+    def close(self):
+        self.stop_matlab()
+
     def __enter__(self):
         """Context manager entry"""
         self.start_matlab()
@@ -3,9 +3,8 @@
 Save PIV results to MATLAB .mat files
 """
 
-import scipy.io
+import os
 import numpy as np
-from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor, nd2_frame_generator
 from pathlib import Path
 
 def save_results_to_mat(results, output_file):
@@ -55,8 +54,11 @@ def save_results_to_mat(results, output_file):
     mat_data['velocity_magnitude'] = vel_mag_cells
     mat_data['typevector'] = typevector_cells
     
-    # Save to .mat file
-    scipy.io.savemat(output_file, mat_data)
+    # Save to .mat file, renamed once complete so an interrupted save never leaves a truncated file
+    import scipy.io
+    with open(output_file + '.partial', 'wb') as f:
+        scipy.io.savemat(f, mat_data)
+    os.replace(output_file + '.partial', output_file)
     print(f"Results saved to {output_file}")
     print(f"  {num_pairs} velocity fields")
     print(f"  Mean velocity: {np.mean(mat_data['mean_velocity']):.2f} px/frame")
@@ -87,6 +89,8 @@ def save_results_incrementally(nd2_path, output_file, piv_params=None, roi=None)
             'smoothing': True
         }
     
+    from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor, nd2_frame_generator
+
     results = []
     
     with PIVlabStreamProcessor() as processor:
@@ -118,6 +122,7 @@ def process_multipoint_to_mat(nd2_path, output_dir, piv_params=None):
     """
     
     from nd2reader import ND2Reader
+    from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor, nd2_frame_generator
     
     output_path = Path(output_dir)
     output_path.mkdir(parents=True, exist_ok=True)
@@ -0,0 +1,27 @@
+function result = stack_pivlab_results(preprocessed, piv_params)
+    % Runs PIV on the consecutive pairs of a cell array of preprocessed frames
+    % Fields of the pairs results are stacked along the 3rd dimension (x, y are the shared grid),
+    % mean_velocity and max_velocity are 1 x pairs vectors
+    pairs = numel(preprocessed) - 1;
+    fields = {'u', 'v', 'typevector', 'velocity_magnitude', ...
+              'u_calibrated', 'v_calibrated', 'velocity_magnitude_calibrated'};
+    result = struct();
+    result.mean_velocity = zeros(1, pairs);
+    result.max_velocity = zeros(1, pairs);
+
+    for pair = 1:pairs
+        pair_result = piv_preprocessed_pair_pivlab(preprocessed{pair}, preprocessed{pair + 1}, piv_params);
+        if pair == 1
+            result.x = pair_result.x;
+            result.y = pair_result.y;
+            for field = fields
+                result.(field{1}) = zeros([size(pair_result.(field{1})), pairs], 'like', pair_result.(field{1}));
+            end
+        end
+        for field = fields
+            result.(field{1})(:, :, pair) = pair_result.(field{1});
+        end
+        result.mean_velocity(pair) = pair_result.mean_velocity;
+        result.max_velocity(pair) = pair_result.max_velocity;
+    end
+end
@@ -0,0 +1,256 @@
+from abc import ABC, abstractmethod
+import numpy as np
+import time
+import os
+from config.settings import Settings
+from profiling.profiler import Profiler, get_metrics_message
+from works.tqdm_report_strategy import TqdmReportStrategy
+
+
+def should_handle_multipoint_channel_combination(roi_data):
+    return roi_data is not None and len(roi_data.keys()) > 0
+
+
+def get_roi_slices(roi):
+    """Returns the (y, x) slices cropping a frame to roi = [x_min, y_min, x_max, y_max]"""
+    x_min, y_min, x_max, y_max = roi
+    return slice(y_min, y_max), slice(x_min, x_max)
+
+
+def get_frames_block_stats(block, stats):
+    """
+    Reduces a (frames, y, x) block to per frame statistics, a single vectorized call per statistic.
+    stats: names of arguments.z_axis_profile_stats.Z_AXIS_PROFILE_STATS or p<q> for the q percentile, e.g. p95
+    """
+    pixels = block.reshape(len(block), -1)
+    res = {}
+    for stat in stats:
+        if stat == 'mean':
+            res[stat] = pixels.mean(axis=1, dtype=np.float64)
+        elif stat == 'std':
+            res[stat] = pixels.std(axis=1, dtype=np.float64)
+        elif stat == 'min':
+            res[stat] = pixels.min(axis=1).astype(np.float64)
+        elif stat == 'max':
+            res[stat] = pixels.max(axis=1).astype(np.float64)
+        elif stat == 'sum':
+            res[stat] = pixels.sum(axis=1, dtype=np.float64)
+        else:
+            res[stat] = np.percentile(pixels, float(stat[1:]), axis=1)
+    return res
+
+
+def concatenate_blocks_stats(blocks_stats, stats):
+    """Joins the statistics of consecutive blocks into {stat: np.ndarray of all frames}"""
+    blocks_stats = list(blocks_stats)
+    res = {}
+    for stat in stats:
+        res[stat] = np.concatenate([block_stats[stat] for block_stats in blocks_stats]) if blocks_stats else \
+            np.empty(0)
+    return res
+
+
+def get_channel_dir(output_dir,  multipoint, channel, roi):
+    directory_name = f"FOV_{multipoint + 1}_Channel_{channel + 1}"
+    if roi is not None :
+        x_min, y_min, x_max, y_max = roi
+        directory_name += f"_ROI_{x_min}_{y_min}_{x_max}_{y_max}"
+    return os.path.join(output_dir, directory_name)
+
+
+class ND2ReaderBackend(ABC):
+    """
+    Common interface of the nd2 reading backends.
+    Backends implement the axis queries and single frame access, reading/writing generators and
+    tiff extraction are shared.
+    """
+    _instance = None
+
+    @classmethod
+    def instance(cls, input_file):
+        if cls._instance is not None:
+            current_input_file = cls._instance.get_input_file()
+            if current_input_file != input_file:
+                cls._instance.close()
+                cls._instance = cls(input_file)
+        else:
+            cls._instance = cls(input_file)
+        return cls._instance
+
+    def __init__(self, input_file):
+        self.input_file = input_file
+
+    def get_input_file(self):
+        return self.input_file
+
+    @abstractmethod
+    def get_multipoints_number(self):
+        pass
+
+    @abstractmethod
+    def get_channels_number(self):
+        pass
+
+    @abstractmethod
+    def get_timepoints(self):
+        pass
+
+    @abstractmethod
+    def get_channel_names(self):
+        pass
+
+    @abstractmethod
+    def get_image(self, multipoint, channel, timepoint, roi=None):
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
+
+    def get_first_images(self):
+        res = {}
+        multipoints = self.get_multipoints_number()
+        channels = self.get_channels_number()
+        for multipoint in range(multipoints):
+            for channel in range(channels):
+                key = str(multipoint) + '_' + str(channel)
+                res[key] = self.get_image(multipoint, channel, 0)
+        return res
+
+    def get_series_reader(self, multipoint, channel, roi=None):
+        """Returns a function reading a single timepoint of the (multipoint, channel) series"""
+        return lambda timepoint: self.get_image(multipoint, channel, timepoint, roi=roi)
+
+    def nd2_images_reader_generator(self, multipoint, channel, roi, report_strategy, timepoints=None):
+        """timepoints: range of the timepoints to read, all timepoints by default"""
+        read_image = self.get_series_reader(multipoint, channel, roi)
+        for t in range(self.get_timepoints()) if timepoints is None else timepoints:
+            read_start = time.time()
+            img = read_image(t)
+            Profiler.instance().inc('read', time.time() - read_start)
+            report_strategy.read_progress()
+            yield img
+
+    def nd2_z_axis_profile_generator(self, read_generator, report_strategy):
+        for frame in read_generator:
+            res = frame.mean()
+            report_strategy.mean_progress()
+            yield res
+
+    def nd2_images_writer_generator(self, read_generator, frame_writer):
+        frame_idx = 0
+        try:
+            for image in read_generator:
+                frame_writer.write(frame_idx, image)
+                frame_idx += 1
+                yield image
+        finally:
+            frame_writer.close()
+
+    def nd2_images_generator(self, multipoint=0, channel=0, roi=None, output_dir=None):
+        from tqdm import tqdm
+        from tiff_tools.tiff_writers import TiffFilesWriter
+        total_planes = self.get_total_planes()
+        progress_bars = {}
+        if output_dir is None:
+            progress_bars['Read'] = tqdm(total=total_planes, desc=f"Reading planes", position=0, leave=True)
+        else:
+            progress_bars['Write'] = tqdm(total=total_planes, desc=f"Writing planes", position=0, leave=True)
+        report_strategy = TqdmReportStrategy(progress_bars)
+        read_generator = self.nd2_images_reader_generator(multipoint, channel, roi, report_strategy)
+        res = None
+        if output_dir is None:
+            res = read_generator
+        else:
+            channel_dir = get_channel_dir(output_dir, multipoint, channel, roi)
+            os.makedirs(channel_dir, exist_ok=True)
+            res = self.nd2_images_writer_generator(read_generator, TiffFilesWriter(channel_dir, report_strategy))
+        return res
+
+    def get_total_planes(self):
+        return self.get_timepoints() * self.get_channels_number() * self.get_multipoints_number()
+
+    def get_total_plane_pairs(self):
+        return (self.get_timepoints() - 1) * self.get_channels_number() * self.get_multipoints_number()
+
+    def extract_tiffs(self, output_dir, roi_data, tiff_output_mode='files', tiff_contiguous=False,
+                      compression_options=None):
+        """
+        tiff_output_mode: 'files' - a directory per series with a tiff file per frame,
+                          'stack' / 'ome_stack' - a single BigTIFF / OME-TIFF file per series
+        compression_options: tifffile write arguments, see Arguments.get_tiff_compression_options
+        """
+        from tqdm import tqdm
+        from tiff_tools.tiff_writers import TiffFilesWriter, TiffStackWriter, get_tiff_stack_file
+        start_time = time.time()
+        read_time = 0
+        write_time = 0
+
+        print("Input: " + self.input_file)
+        print("Output: " + output_dir)
+        num_fovs = self.get_multipoints_number()
+        num_channels = self.get_channels_number()
+        num_frames = self.get_timepoints()
+        print(f"Multipoints: {num_fovs}, channels: {num_channels}, timepoints: {num_frames}")
+
+        total_planes = self.get_total_planes()
+
+        skip_missing_roi = Settings.instance().get("roi_skip_empty") == "true"
+
+        with tqdm(total=total_planes, desc=f"Exporting planes", position=0, leave=True) as progress_bar:
+            report_strategy = TqdmReportStrategy({'Write': progress_bar})
+
+            for fov in range(num_fovs):
+                tqdm.write(f"Processing FOV {fov + 1}/{num_fovs}")
+
+                for channel in range(num_channels):
+                    key = f"{fov}_{channel}"
+
+                    extract_image_series = True
+                    if should_handle_multipoint_channel_combination(roi_data):
+                        if key not in roi_data.keys() and skip_missing_roi:
+                            extract_image_series = False
+
+                    if extract_image_series is True:
+                        roi = None
+                        if roi_data is not None and key in roi_data.keys() and roi_data[key] is not None:
+                            roi = roi_data[key]
+
+                        series_output = get_channel_dir(output_dir, fov, channel, roi)
+                        if tiff_output_mode == 'files':
+                            # Create output directory
+                            os.makedirs(series_output, exist_ok=True)
+                            frame_writer = TiffFilesWriter(series_output, report_strategy, compression_options)
+                        else:
+                            os.makedirs(output_dir, exist_ok=True)
+                            ome = tiff_output_mode == 'ome_stack'
+                            series_output = get_tiff_stack_file(output_dir, os.path.basename(series_output), ome)
+                            frame_writer = TiffStackWriter(series_output, num_frames, report_strategy, ome=ome,
+                                                           contiguous=tiff_contiguous,
+                                                           compression_options=compression_options)
+
+                        frame_idx = 0
+                        read_image = self.get_series_reader(fov, channel, roi)
+
+                        for t in tqdm(range(num_frames), desc=f"FOV {fov + 1} Ch {channel + 1}", position=1,
+                                      leave=False):
+                            read_start = time.time()
+
+                            img = read_image(t)
+
+                            read_time += time.time() - read_start
+
+                            write_start = time.time()
+                            frame_writer.write(frame_idx, img)
+                            write_time += time.time() - write_start
+
+                            frame_idx += 1
+                        frame_writer.close()
+                        tqdm.write(f"  Saved {frame_idx} frames to {series_output}")
+                        tqdm.write(f"  Data type: {img.dtype}, min: {img.min()}, max: {img.max()}")
+        end_time = time.time()
+        print(f"\n=== Performance Summary ===")
+        print(f"Total time: {end_time - start_time:.2f} seconds")
+        print(f"Read time: {read_time:.2f} seconds")
+        print(f"Write time: {write_time:.2f} seconds")
+        print(get_metrics_message(Profiler.instance().metrics, {'write': write_time}), end='')
@@ -1,20 +1,32 @@
-from nd2 import ND2File
-from tqdm import tqdm
 import time
-import os
-import tifffile
+from config.settings import Settings
+from profiling.profiler import Profiler
+from nd2_tools.nd2_wrapper import get_frame_index
+from nd2_tools.nd2_reader_backend import ND2ReaderBackend, get_roi_slices
 
 
-class ND2Wrapper2:
+class ND2Wrapper2(ND2ReaderBackend):
+    """
+    Reads frames through the memory-mapped nd2.ND2File.
+    Frames of uncompressed files are served as views over the mapped file data (no copy),
+    lossless compressed files are decompressed into a new array per frame.
+    With read_chunk_size (settings.json) > 1, timepoints are read in chunks, each chunk a single slice of the
+    file dask array.
+    """
+
     def __init__(self, input_file):
-        self.input_file = input_file
+        super().__init__(input_file)
+        from nd2 import ND2File
         self.nd2_file = ND2File(self.input_file)
-        self.xarr = self.nd2_file.to_xarray(delayed=True)
+        self.dask_array = None
+
+    def is_compressed(self):
+        return self.nd2_file.attributes.compressionType is not None
 
     def get_multipoints_number(self):
         res = 1
-        if 'V' in self.nd2_file.sizes:
-            res = self.nd2_file.sizes['V']
+        if 'P' in self.nd2_file.sizes:
+            res = self.nd2_file.sizes['P']
         return res
 
     def get_channels_number(self):
@@ -23,7 +35,7 @@ class ND2Wrapper2:
             res = self.nd2_file.sizes['C']
         return res
 
-    def get_time_points(self):
+    def get_timepoints(self):
         res = 1
         if 'T' in self.nd2_file.sizes:
             res = self.nd2_file.sizes['T']
@@ -31,8 +43,8 @@ class ND2Wrapper2:
 
     def get_channel_names(self):
         channel_names = []
-        if 'channels' in self.nd2_file.metadata:
-            channel_names = self.nd2_file.metadata['channels']
+        if self.nd2_file.metadata.channels:
+            channel_names = [channel.channel.name for channel in self.nd2_file.metadata.channels]
         else:
             # Fallback if names aren't available
             num_channels = self.get_channels_number()
@@ -40,97 +52,64 @@ class ND2Wrapper2:
         return channel_names
 
     def get_image(self, multipoint, channel, timepoint, roi=None):
-        # Build dimension selection with INTEGER positions
-        isel_dict = {}
-        if 'V' in self.xarr.dims:
-            isel_dict['V'] = multipoint
-        if 'C' in self.xarr.dims:
-            isel_dict['C'] = channel
-        if 'T' in self.xarr.dims:
-            isel_dict['T'] = timepoint
-        # Select dimensions by INTEGER position
-        result = self.xarr.isel(**isel_dict)
-        # Apply ROI crop if provided
+        res = self.nd2_file.read_frame(get_frame_index(self.nd2_file, multipoint, timepoint))
+        if 'C' in self.nd2_file.sizes:
+            res = res[channel]
+        # ROI crop is a slice of the frame view, no pixels are copied
         if roi is not None:
             x_min, y_min, x_max, y_max = roi
-            result = result.isel(Y=slice(y_min, y_max), X=slice(x_min, x_max))
-        return result.values
-
-    def get_first_images(self):
-        res = {}
-        multipoints = self.get_multipoints_number()
-        channels = self.get_channels_number()
-        for multipoint in range(multipoints):
-            for channel in range(channels):
-                key = str(multipoint) + '_' + str(channel)
-                res[key] = self.get_image(multipoint, channel, 0)
+            res = res[y_min:y_max, x_min:x_max]
         return res
 
-    def extract_tiffs(self, output_dir, roi_data):
-        start_time = time.time()
-        read_time = 0
-        write_time = 0
-
-        print("Input: " + self.input_file)
-        print("Output: " + output_dir)
-
-        # Open the ND2 file
-        images = self.nd2_file
-        print(f"Image shape: {images.sizes}")
-        time_points = self.get_time_points()
-        channels = self.get_channels_number()
-        multi_points = self.get_multipoints_number()
-        total_planes = time_points * channels * multi_points
-
-        with tqdm(total=total_planes, desc=f"Exporting planes", position=0, leave=True) as progress_bar:
-
-            # Iterate through multipoints (if they exist)
-
-            for fov in range(multi_points):
-                tqdm.write(f"Processing FOV {fov + 1}/{multi_points}")
-
-                for channel in range(channels):
-                    directory_name = f"FOV_{fov + 1}_Channel_{channel + 1}"
-                    roi = None
-                    x_min = None
-                    y_min = None
-                    x_max = None
-                    y_max = None
-                    if roi_data is not None:
-                        roi = roi_data[f"{fov}_{channel}"]
-                        x_min, y_min, x_max, y_max = roi
-                        directory_name += f"_ROI_{x_min}_{y_min}_{x_max}_{y_max}"
-
-                    # Create output directory
-                    channel_dir = os.path.join(output_dir, directory_name)
-                    os.makedirs(channel_dir, exist_ok=True)
-
-                    frame_idx = 0
-
-                    for t in tqdm(range(time_points), desc=f"FOV {fov + 1} Ch {channel + 1}", position=1,
-                                  leave=False):
-                        read_start = time.time()
-                        img = self.get_image(fov, channel, t, roi=roi)
-                        read_time += time.time() - read_start
-
-                        # Save as TIFF - raw pixel data, no scaling or color mapping
-                        output_path = os.path.join(channel_dir, f"img_{frame_idx:04d}.tif")
-                        write_start = time.time()
-                        tifffile.imwrite(output_path, img, photometric='minisblack')
-                        write_time += time.time() - write_start
-
-                        frame_idx += 1
-
-                        # Update progress bar
-                        progress_bar.update(1)
-
-                    tqdm.write(f"  Saved {frame_idx} frames to {channel_dir}")
-                    tqdm.write(f"  Data type: {img.dtype}, min: {img.min()}, max: {img.max()}")
-        end_time = time.time()
-        print(f"\n=== Performance Summary ===")
-        print(f"Total time: {end_time - start_time:.2f} seconds")
-        print(f"Read time: {read_time:.2f} seconds")
-        print(f"Write time: {write_time:.2f} seconds")
+    def get_read_chunk_size(self):
+        res = Settings.instance().get('read_chunk_size')
+        return 1 if res is None else int(res)
+
+    def read_chunk(self, multipoint, channel, timepoints, roi=None):
+        """Reads the timepoints (range) of a (multipoint, channel) series into a single (frames, y, x) array"""
+        roi_slices = (slice(None), slice(None)) if roi is None else get_roi_slices(roi)
+        index = []
+        for axis in self.nd2_file.sizes:
+            if axis == 'T':
+                index.append(slice(timepoints.start, timepoints.stop, timepoints.step))
+            elif axis == 'P':
+                index.append(multipoint)
+            elif axis == 'C':
+                index.append(channel)
+            elif axis == 'Y':
+                index.append(roi_slices[0])
+            elif axis == 'X':
+                index.append(roi_slices[1])
+            elif axis == 'S':
+                index.append(slice(None))
+            else:
+                index.append(0)
+        res = self.get_dask_array()[tuple(index)].compute()
+        if 'T' not in self.nd2_file.sizes:
+            res = res[None]
+        return res
+
+    def get_dask_array(self):
+        # frames are not copied out of the mapped file before the chunk is assembled
+        if self.dask_array is None:
+            self.dask_array = self.nd2_file.to_dask(copy=False)
+        return self.dask_array
+
+    def nd2_images_reader_generator(self, multipoint, channel, roi, report_strategy, timepoints=None):
+        chunk_size = self.get_read_chunk_size()
+        timepoints = range(self.get_timepoints()) if timepoints is None else timepoints
+        if chunk_size > 1:
+            for chunk_start in range(0, len(timepoints), chunk_size):
+                read_start = time.time()
+                chunk = self.read_chunk(multipoint, channel, timepoints[chunk_start:chunk_start + chunk_size], roi=roi)
+                Profiler.instance().inc('read', time.time() - read_start)
+                # frames are views into the chunk, a new chunk is allocated on each read so frames
+                # held by downstream consumers (e.g. previous frame of a PIV pair) stay valid
+                for frame in chunk:
+                    report_strategy.read_progress()
+                    yield frame
+        else:
+            yield from super().nd2_images_reader_generator(multipoint, channel, roi, report_strategy, timepoints)
 
     def close(self):
         self.nd2_file.close()
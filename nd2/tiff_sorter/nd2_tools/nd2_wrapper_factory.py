@@ -0,0 +1,13 @@
+from nd2_tools.nd2_wrapper import ND2Wrapper
+from nd2_tools.nd2_wrapper2 import ND2Wrapper2
+
+# nd2reader: frames read through nd2reader.ND2Reader
+# nd2: zero-copy frames over the memory-mapped nd2.ND2File
+READER_BACKENDS = {
+    'nd2reader': ND2Wrapper,
+    'nd2': ND2Wrapper2
+}
+
+
+def get_nd2_wrapper(input_file, reader_backend='nd2reader'):
+    return READER_BACKENDS[reader_backend].instance(input_file)
@@ -0,0 +1,230 @@
+# numpy_piv.py
+"""
+Multi-pass FFT cross-correlation PIV in NumPy / SciPy, an alternative to PIVlab through the MATLAB engine.
+
+Follows PIVlab piv_FFTmulti: the first pass uses interrogationarea windows every step pixels, the next passes
+use int2..int4 windows with 50% overlap. All windows of a pass are correlated at once (FFT of the
+(rows, cols, window, window) stack), the peak is located with a 3-point Gaussian fit and later passes
+correlate images deformed by the displacement of the previous pass ('*linear' / '*spline' imdeform).
+Masks, repeated correlation (repeat), linear correlation and the repeat_last_pass loop are not supported,
+these params are ignored.
+"""
+
+import time
+import numpy as np
+import scipy.fft
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy import ndimage, signal
+from profiling.profiler import Profiler
+from piv_tools.piv_params import validate_piv_params
+
+
+def preprocess_frame(image, piv_params):
+    """PIVlab_preproc: intensity capping, CLAHE, highpass, Wiener denoising and intensity range, float32 [0, 1]"""
+    res = image.astype(np.float32)
+    if np.issubdtype(image.dtype, np.integer):
+        res /= np.iinfo(image.dtype).max
+    if piv_params['intenscap']:
+        upper_limit = np.median(res) + 2 * res.std()
+        np.minimum(res, upper_limit, out=res)
+    if piv_params['clahe']:
+        from skimage.exposure import equalize_adapthist
+        res = equalize_adapthist(np.clip(res, 0, 1), kernel_size=int(piv_params['clahesize'])).astype(np.float32)
+    if piv_params['highp']:
+        res -= ndimage.gaussian_filter(res, float(piv_params['highpsize']), mode='nearest')
+    if piv_params['wienerwurst']:
+        size = int(piv_params['wienerwurstsize'])
+        res = signal.wiener(res, (size, size)).astype(np.float32)
+    low = res.min()
+    high = res.max()
+    if high > low:
+        res = (res - low) / (high - low)
+    min_intensity = float(piv_params['minintens'])
+    max_intensity = float(piv_params['maxintens'])
+    if max_intensity > min_intensity and (min_intensity > 0 or max_intensity < 1):
+        res = np.clip((res - min_intensity) / (max_intensity - min_intensity), 0, 1)
+    return res
+
+
+def get_pass_windows(piv_params):
+    """[[window, step]...] of the passes"""
+    passes = int(piv_params['passes'])
+    windows = [int(piv_params['interrogationarea']), int(piv_params['int2']), int(piv_params['int3']),
+               int(piv_params['int4'])]
+    res = [[windows[0], int(piv_params['step'])]]
+    for window in windows[1:passes]:
+        res.append([window, max(window // 2, 1)])
+    return res
+
+
+def get_grid(shape, window, step):
+    """0-based pixel coordinates of the windows centers along y and x"""
+    ys = np.arange(0, shape[0] - window + 1, step) + (window - 1) / 2
+    xs = np.arange(0, shape[1] - window + 1, step) + (window - 1) / 2
+    return ys, xs
+
+
+def correlate_windows(image_a, image_b, window, step):
+    """Circular cross-correlation of all (window, window) windows, zero displacement at [window // 2, window // 2]"""
+    windows_a = sliding_window_view(image_a, (window, window))[::step, ::step]
+    windows_b = sliding_window_view(image_b, (window, window))[::step, ::step]
+    windows_a = windows_a - windows_a.mean(axis=(2, 3), keepdims=True)
+    windows_b = windows_b - windows_b.mean(axis=(2, 3), keepdims=True)
+    spectrum = np.conj(scipy.fft.rfft2(windows_a, workers=-1)) * scipy.fft.rfft2(windows_b, workers=-1)
+    correlation = scipy.fft.irfft2(spectrum, s=(window, window), workers=-1)
+    return scipy.fft.fftshift(correlation, axes=(2, 3))
+
+
+def gaussian_peak_offset(minus, center, plus):
+    """3-point Gaussian fit of the peak position relative to center"""
+    ln_minus = np.log(minus)
+    ln_center = np.log(center)
+    ln_plus = np.log(plus)
+    denominator = 2 * ln_minus - 4 * ln_center + 2 * ln_plus
+    with np.errstate(divide='ignore', invalid='ignore'):
+        res = np.where(denominator != 0, (ln_minus - ln_plus) / denominator, 0)
+    return res
+
+
+def find_peaks(correlation, subpixel=True):
+    """Displacement [dy, dx] of the correlation peak of every window"""
+    rows, cols, height, width = correlation.shape
+    # PIVlab shifts correlation to positive values before the logarithmic fit
+    correlation = correlation - correlation.min(axis=(2, 3), keepdims=True) + np.finfo(np.float32).eps
+    peak = correlation.reshape(rows, cols, -1).argmax(axis=2)
+    peak_y, peak_x = np.divmod(peak, width)
+    # the 3x3 neighborhood must be inside the window
+    peak_y = np.clip(peak_y, 1, height - 2)
+    peak_x = np.clip(peak_x, 1, width - 2)
+    row, col = np.indices((rows, cols))
+    dy = peak_y - height // 2.0
+    dx = peak_x - width // 2.0
+    if subpixel:
+        center = correlation[row, col, peak_y, peak_x]
+        dy = dy + gaussian_peak_offset(correlation[row, col, peak_y - 1, peak_x], center,
+                                       correlation[row, col, peak_y + 1, peak_x])
+        dx = dx + gaussian_peak_offset(correlation[row, col, peak_y, peak_x - 1], center,
+                                       correlation[row, col, peak_y, peak_x + 1])
+    return dy, dx
+
+
+def replace_outliers(field, threshold=2.0, epsilon=0.1):
+    """Normalized median test (Westerweel & Scarano) on a 3x3 neighborhood, outliers take the median value"""
+    median = ndimage.median_filter(field, size=3, mode='nearest')
+    residual = np.abs(field - median)
+    median_residual = ndimage.median_filter(residual, size=3, mode='nearest')
+    return np.where(residual / (median_residual + epsilon) > threshold, median, field)
+
+
+def interpolate_field(field, ys, xs, at_ys, at_xs, order=1):
+    """Values of field given on the (ys, xs) grid at the (at_ys, at_xs) grid, constant beyond the borders"""
+    coordinates_y = (at_ys - ys[0]) / (ys[1] - ys[0]) if len(ys) > 1 else np.zeros_like(at_ys)
+    coordinates_x = (at_xs - xs[0]) / (xs[1] - xs[0]) if len(xs) > 1 else np.zeros_like(at_xs)
+    coordinates = np.meshgrid(coordinates_y, coordinates_x, indexing='ij')
+    return ndimage.map_coordinates(field, coordinates, order=order, mode='nearest')
+
+
+def deform_images(image_a, image_b, u, v, ys, xs, order):
+    """Moves image_a forward and image_b backward by half the (u, v) displacement given on the (ys, xs) grid"""
+    pixel_ys = np.arange(image_a.shape[0], dtype=np.float32)
+    pixel_xs = np.arange(image_a.shape[1], dtype=np.float32)
+    dense_u = interpolate_field(u, ys, xs, pixel_ys, pixel_xs)
+    dense_v = interpolate_field(v, ys, xs, pixel_ys, pixel_xs)
+    grid_y, grid_x = np.meshgrid(pixel_ys, pixel_xs, indexing='ij')
+    deformed_a = ndimage.map_coordinates(image_a, [grid_y - dense_v / 2, grid_x - dense_u / 2], order=order,
+                                         mode='nearest')
+    deformed_b = ndimage.map_coordinates(image_b, [grid_y + dense_v / 2, grid_x + dense_u / 2], order=order,
+                                         mode='nearest')
+    return deformed_a, deformed_b
+
+
+def piv_preprocessed_pair(image_a, image_b, piv_params):
+    """
+    Multi-pass PIV of two frames preprocessed by preprocess_frame.
+    Returns the result dict of PIVlabStreamProcessor.process_frame_pair, x / y are 1-based pixel coordinates
+    """
+    order = 3 if 'spline' in str(piv_params['imdeform']) else 1
+    subpixel = int(piv_params['subpixfinder']) > 0
+    u = v = ys = xs = None
+    for pass_index, [window, step] in enumerate(get_pass_windows(piv_params)):
+        pass_ys, pass_xs = get_grid(image_a.shape, window, step)
+        if pass_index == 0:
+            dy, dx = find_peaks(correlate_windows(image_a, image_b, window, step), subpixel)
+            u, v = dx, dy
+        else:
+            # predictor of this pass, validated displacement of the previous pass
+            u = replace_outliers(u)
+            v = replace_outliers(v)
+            deformed_a, deformed_b = deform_images(image_a, image_b, u, v, ys, xs, order)
+            predictor_u = interpolate_field(u, ys, xs, pass_ys, pass_xs)
+            predictor_v = interpolate_field(v, ys, xs, pass_ys, pass_xs)
+            dy, dx = find_peaks(correlate_windows(deformed_a, deformed_b, window, step), subpixel)
+            u = predictor_u + dx
+            v = predictor_v + dy
+        ys, xs = pass_ys, pass_xs
+    x, y = np.meshgrid(xs + 1, ys + 1)
+    u = u.astype(np.float64)
+    v = v.astype(np.float64)
+    velocity_magnitude = np.sqrt(u ** 2 + v ** 2)
+    cal_fact = float(piv_params['cal_fact'])
+    u_calibrated = u * cal_fact
+    v_calibrated = v * cal_fact
+    return {
+        'x': x,
+        'y': y,
+        'u': u,
+        'v': v,
+        'typevector': np.ones(u.shape),
+        'velocity_magnitude': velocity_magnitude,
+        'mean_velocity': float(np.nanmean(velocity_magnitude)),
+        'max_velocity': float(np.nanmax(velocity_magnitude)),
+        'u_calibrated': u_calibrated,
+        'v_calibrated': v_calibrated,
+        'velocity_magnitude_calibrated': np.sqrt(u_calibrated ** 2 + v_calibrated ** 2),
+    }
+
+
+class NumpyPivProcessor:
+    """
+    Same interface as PIVlabStreamProcessor, without MATLAB.
+    The preprocessed last frame of every series is kept to pair it with the next frame.
+    """
+
+    def __init__(self, report_strategy):
+        self.report_strategy = report_strategy
+        self.series_params = {}
+        self.previous_frames = {}
+
+    def process_frame_pair(self, img1, img2, piv_params):
+        validate_piv_params(piv_params)
+        return self.process_preprocessed_frames([preprocess_frame(img1, piv_params),
+                                                 preprocess_frame(img2, piv_params)], piv_params)[0]
+
+    def start_series(self, series_key, piv_params):
+        validate_piv_params(piv_params)
+        self.series_params[series_key] = piv_params
+
+    def process_series_frames(self, series_key, frames, pairs):
+        piv_params = self.series_params[series_key]
+        preprocess_start = time.time()
+        preprocessed = [preprocess_frame(frame, piv_params) for frame in frames]
+        Profiler.instance().inc('numpy_piv_preprocess', time.time() - preprocess_start)
+        if series_key in self.previous_frames:
+            preprocessed.insert(0, self.previous_frames[series_key])
+        self.previous_frames[series_key] = preprocessed[-1]
+        return self.process_preprocessed_frames(preprocessed, piv_params)
+
+    def process_preprocessed_frames(self, preprocessed, piv_params):
+        piv_start = time.time()
+        res = [piv_preprocessed_pair(preprocessed[index], preprocessed[index + 1], piv_params)
+               for index in range(len(preprocessed) - 1)]
+        Profiler.instance().inc('numpy_piv', time.time() - piv_start)
+        return res
+
+    def end_series(self, series_key):
+        self.series_params.pop(series_key, None)
+        self.previous_frames.pop(series_key, None)
+
+    def close(self):
+        self.series_params = {}
+        self.previous_frames = {}
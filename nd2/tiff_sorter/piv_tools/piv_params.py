@@ -0,0 +1,11 @@
+# fields process_single_pair_pivlab.m and the numpy PIV engine read from the PIV params
+PIV_PARAMS_FIELDS = ['clahe', 'clahesize', 'highp', 'highpsize', 'intenscap', 'wienerwurst', 'wienerwurstsize',
+                     'minintens', 'maxintens', 'interrogationarea', 'step', 'subpixfinder', 'passes', 'int2', 'int3',
+                     'int4', 'imdeform', 'repeat', 'mask_auto', 'do_linear_correlation', 'repeat_last_pass',
+                     'delta_diff_min', 'cal_fact']
+
+
+def validate_piv_params(piv_params):
+    missing = [field for field in PIV_PARAMS_FIELDS if field not in piv_params]
+    if missing:
+        raise ValueError(f"PIV params are missing {', '.join(missing)}")
@@ -0,0 +1,13 @@
+# PIV engines are imported on demand, the numpy engine runs without the MATLAB engine package installed
+PIV_ENGINES = ['matlab', 'numpy']
+
+
+def get_piv_processor(piv_engine, report_strategy, engine_slot=0):
+    res = None
+    if piv_engine == 'numpy':
+        from piv_tools.numpy_piv import NumpyPivProcessor
+        res = NumpyPivProcessor(report_strategy)
+    else:
+        from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor
+        res = PIVlabStreamProcessor(report_strategy, engine_slot)
+    return res
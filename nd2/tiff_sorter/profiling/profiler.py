@@ -1,10 +1,23 @@
 import os
 import time
+import threading
+
+
+def get_metrics_message(metrics, counters):
+    message = ""
+    raw_bytes = metrics.get('tiff_raw_bytes', 0)
+    file_bytes = metrics.get('tiff_file_bytes', 0)
+    if raw_bytes > 0 and file_bytes > 0:
+        message += f"tiff compression ratio : {raw_bytes / file_bytes:.2f} ({raw_bytes / 1e6:.1f} MB -> {file_bytes / 1e6:.1f} MB)\n"
+    if raw_bytes > 0 and counters.get('write', 0) > 0:
+        message += f"tiff write throughput : {raw_bytes / 1e6 / counters['write']:.1f} MB/s of raw pixel data\n"
+    return message
 
 
 def get_summary_message(summary_data):
     process_id = summary_data.pop('process_id')
     total_time = summary_data.pop('total_time')
+    metrics = summary_data.pop('metrics', {})
     summary_message = f"Profiling data for process {process_id}\n-------------------------------\n"
     summary_message += f"Total time: {total_time}\n"
     for key in summary_data.keys():
@@ -12,9 +25,24 @@ def get_summary_message(summary_data):
         if total_time > 0:
             percentage = (summary_data[key] / total_time) * 100
         summary_message += f"{key} : {summary_data[key]:.2f} seconds {percentage:.2f}%\n"
+    summary_message += get_metrics_message(metrics, summary_data)
     return summary_message
 
 
+def add_summary_data(total, summary_data):
+    """Sums the summary data of the series handled by the same process, total is None for the first series"""
+    res = summary_data.copy()
+    res['metrics'] = summary_data.get('metrics', {}).copy()
+    if total is not None:
+        for key, value in total.items():
+            if key == 'metrics':
+                for metric, metric_value in value.items():
+                    res['metrics'][metric] = res['metrics'].get(metric, 0) + metric_value
+            elif key != 'process_id':
+                res[key] = res.get(key, 0) + value
+    return res
+
+
 class Profiler:
 
     _instance = None
@@ -30,12 +58,22 @@ class Profiler:
         cls._instance = cls()
 
     def inc(self, key, value):
-        self.counters[key] += value
+        # counters are also incremented from writer threads
+        with self.lock:
+            self.counters[key] += value
+
+    def inc_metric(self, key, value):
+        # non-time measurements, e.g. bytes written
+        with self.lock:
+            self.metrics[key] = self.metrics.get(key, 0) + value
 
     def __init__(self):
         self.total_times = {}
         self.print_summary = True
         self.counters = None
+        self.metrics = None
+        self.lock = threading.Lock()
+        self.init()
         self.start_time = None
         self.end_time = None
 
@@ -46,11 +84,13 @@ class Profiler:
         self.print_summary = value
 
     def init(self):
-        counters = ['read', 'write', 'matlab_start', 'matlab_add_path', 'convert_to_matlab_format',
-                    'dict_to_matlab_struct', 'process_single_pair_pivlab', 'convert_back_to_python']
+        counters = ['read', 'write', 'write_queue_wait', 'zarr_write', 'matlab_start', 'matlab_add_path',
+                    'convert_to_matlab_format', 'dict_to_matlab_struct', 'process_single_pair_pivlab',
+                    'process_series_frames_pivlab', 'convert_back_to_python', 'numpy_piv_preprocess', 'numpy_piv']
         default_value = 0
         new_dict = dict.fromkeys(counters, default_value)
         self.counters = new_dict
+        self.metrics = {}
 
     def start(self, start_time):
         self.start_time = start_time
@@ -66,6 +106,7 @@ class Profiler:
 
     def get_summary_data(self):
         res = self.counters.copy()
+        res['metrics'] = self.metrics.copy()
         res['process_id'] = os.getpid()
         res['total_time'] = self.get_total_time()
         return res
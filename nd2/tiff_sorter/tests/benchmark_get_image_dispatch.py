@@ -0,0 +1,61 @@
+# Measures the per-frame dispatch overhead of ND2Wrapper.get_image before and after the per-file frame-access plan.
+# nd2reader is replaced by an in-memory reader returning a preallocated frame, so only the dispatch cost is timed.
+# usage (from tiff_sorter directory): PYTHONPATH=. python tests/benchmark_get_image_dispatch.py [frames]
+import sys
+import time
+import numpy as np
+from nd2_tools.nd2_wrapper import ND2Wrapper
+
+
+class InMemoryReader:
+    def __init__(self, axes):
+        self.axes = axes
+        self.frame = np.zeros((512, 512), dtype=np.uint16)
+
+    def get_frame_2D(self, c=0, t=0, z=0, x=0, y=0, v=0):
+        return self.frame
+
+    def __getitem__(self, index):
+        return self.frame
+
+
+def legacy_get_image(nd2_reader, multipoint, channel, timepoint, roi=None):
+    # ND2Wrapper.get_image prior to the frame-access plan
+    res = None
+    if 'v' in nd2_reader.axes and 'c' in nd2_reader.axes and 't' in nd2_reader.axes:
+        res = nd2_reader.get_frame_2D(v=multipoint, c=channel, t=timepoint)
+    elif 'v' in nd2_reader.axes and 't' in nd2_reader.axes:
+        res = nd2_reader.get_frame_2D(v=multipoint, t=timepoint)
+    elif 'c' in nd2_reader.axes and 't' in nd2_reader.axes:
+        res = nd2_reader.get_frame_2D(c=channel, t=timepoint)
+    elif 'v' in nd2_reader.axes and 'c' in nd2_reader.axes:
+        res = nd2_reader.get_frame_2D(v=multipoint, c=channel)
+    elif 'c' in nd2_reader.axes:
+        res = nd2_reader.get_frame_2D(c=channel)
+    else:
+        res = nd2_reader[timepoint] if 't' in nd2_reader.axes else nd2_reader[0]
+    if roi is not None:
+        x_min, y_min, x_max, y_max = roi
+        res = res[y_min:y_max, x_min:x_max]
+    return res
+
+
+def per_frame_ns(read_image, frames):
+    start = time.perf_counter_ns()
+    for t in range(frames):
+        read_image(t)
+    return (time.perf_counter_ns() - start) / frames
+
+
+if __name__ == "__main__":
+    frames = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    roi = [10, 20, 266, 276]
+    print(f"{'axes':<10}{'roi':<6}{'before [ns/frame]':>20}{'after [ns/frame]':>20}")
+    for axes in [['t'], ['c', 't'], ['v', 't'], ['v', 'c', 't']]:
+        for series_roi in [None, roi]:
+            nd2_wrapper = ND2Wrapper.__new__(ND2Wrapper)
+            nd2_wrapper.nd2_reader = InMemoryReader(axes + ['x', 'y'])
+            nd2_wrapper.read_frame = nd2_wrapper.compile_frame_reader()
+            before = per_frame_ns(lambda t: legacy_get_image(nd2_wrapper.nd2_reader, 0, 0, t, roi=series_roi), frames)
+            after = per_frame_ns(nd2_wrapper.get_series_reader(0, 0, series_roi), frames)
+            print(f"{''.join(axes):<10}{'yes' if series_roi else 'no':<6}{before:>20.1f}{after:>20.1f}")
@@ -0,0 +1,48 @@
+# Measures numpy -> MATLAB and MATLAB -> numpy conversion throughput, legacy vs matlab_transfer path
+# requires the MATLAB engine python package, no MATLAB session is started
+# usage (from tiff_sorter directory):
+#   PYTHONPATH=. python tests/benchmark_matlab_transfer.py [frame size] [frames per block] [repeats]
+import sys
+import time
+import numpy as np
+import matlab
+from matlab_integration.matlab_transfer import (numpy_to_matlab, matlab_to_numpy, stack_frames,
+                                                is_buffer_protocol_supported)
+
+
+def legacy_to_matlab(frames):
+    block = np.stack(frames, axis=2)
+    if block.dtype != np.uint16:
+        block = block.astype(np.uint16)
+    return matlab.uint16(block)
+
+
+def fast_to_matlab(frames):
+    return numpy_to_matlab(stack_frames(frames))
+
+
+def measure(function, argument, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        res = function(argument)
+    return res, (time.perf_counter() - start) / repeats
+
+
+if __name__ == "__main__":
+    frame_size = int(sys.argv[1]) if len(sys.argv) > 1 else 2048
+    block_frames = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    repeats = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    print(f"buffer protocol supported: {is_buffer_protocol_supported()}")
+    frames = [np.random.randint(0, 4096, (frame_size, frame_size), dtype=np.uint16) for _ in range(block_frames)]
+    frames_bytes = sum(frame.nbytes for frame in frames)
+    # PIV results come back as double matrices
+    result = np.random.rand(frame_size, frame_size)
+    matlab_result = matlab.double(result)
+    print(f"{'direction':<20}{'path':<10}{'seconds':>10}{'MB/s':>12}")
+    for [name, function] in [['legacy', legacy_to_matlab], ['fast', fast_to_matlab]]:
+        _, elapsed = measure(function, frames, repeats)
+        print(f"{'numpy -> MATLAB':<20}{name:<10}{elapsed:>10.3f}{frames_bytes / elapsed / 1e6:>12.1f}")
+    for [name, function] in [['legacy', np.array], ['fast', matlab_to_numpy]]:
+        converted, elapsed = measure(function, matlab_result, repeats)
+        assert np.array_equal(converted, result)
+        print(f"{'MATLAB -> numpy':<20}{name:<10}{elapsed:>10.3f}{result.nbytes / elapsed / 1e6:>12.1f}")
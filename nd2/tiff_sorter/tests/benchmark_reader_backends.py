@@ -0,0 +1,43 @@
+# Reads the same (multipoint, channel) series with every reader backend and reports frames/s and MB/s
+# usage (from tiff_sorter directory):
+#   PYTHONPATH=. python tests/benchmark_reader_backends.py <nd2 file> [multipoint] [channel] [read_chunk_size]
+import sys
+import time
+from nd2_tools.nd2_wrapper_factory import READER_BACKENDS
+from config.settings import Settings
+from tests.no_report_strategy import NoReportStrategy
+from profiling.profiler import Profiler
+
+
+def benchmark(backend_class, input_file, multipoint, channel):
+    nd2_wrapper = backend_class(input_file)
+    frames = 0
+    total_bytes = 0
+    start = time.perf_counter()
+    for frame in nd2_wrapper.nd2_images_reader_generator(multipoint, channel, None, NoReportStrategy()):
+        # touch the pixels, zero-copy backends would otherwise not read the data from disk
+        frame.max()
+        frames += 1
+        total_bytes += frame.nbytes
+    elapsed = time.perf_counter() - start
+    nd2_wrapper.close()
+    return frames, total_bytes, elapsed
+
+
+if __name__ == "__main__":
+    input_file = sys.argv[1]
+    multipoint = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    channel = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    read_chunk_size = int(sys.argv[4]) if len(sys.argv) > 4 else 64
+    Profiler.instance().set_print_summary(False)
+    Profiler.instance().start(time.time())
+    runs = []
+    for name, backend_class in READER_BACKENDS.items():
+        runs.append([name, backend_class])
+        if name == 'nd2':
+            runs.append([f"{name} (read_chunk_size={read_chunk_size})", backend_class])
+    print(f"{'backend':<40}{'frames':>10}{'seconds':>10}{'frames/s':>12}{'MB/s':>12}")
+    for [name, backend_class] in runs:
+        Settings.instance().set('read_chunk_size', read_chunk_size if 'read_chunk_size' in name else 1)
+        frames, total_bytes, elapsed = benchmark(backend_class, input_file, multipoint, channel)
+        print(f"{name:<40}{frames:>10}{elapsed:>10.2f}{frames / elapsed:>12.1f}{total_bytes / elapsed / 1e6:>12.1f}")
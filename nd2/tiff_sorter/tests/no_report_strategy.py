@@ -0,0 +1,23 @@
+# Report strategy of tests and benchmarks, progress is not reported
+from works.report_strategy import ReportStrategy
+
+
+class NoReportStrategy(ReportStrategy):
+
+    def read_progress(self):
+        pass
+
+    def write_progress(self):
+        pass
+
+    def matlab_progress(self):
+        pass
+
+    def mean_progress(self):
+        pass
+
+    def mean_write_progress(self):
+        pass
+
+    def zarr_write_progress(self):
+        pass
@@ -0,0 +1,54 @@
+# ND2Wrapper frame-access plan: the nd2reader call matching the file axes is selected once per wrapper and
+# get_image / get_series_reader return the pixels of the legacy per-call dispatch
+# (timings are compared by tests/benchmark_get_image_dispatch.py)
+# usage (from tiff_sorter directory):
+#   python -m pytest tests/test_get_image_dispatch.py
+import numpy as np
+import nd2reader
+from nd2_tools.nd2_wrapper import ND2Wrapper
+from tests.benchmark_get_image_dispatch import legacy_get_image
+
+AXES = [['t'], ['c', 't'], ['v', 't'], ['v', 'c', 't'], ['v', 'c'], ['c'], []]
+ROI = [2, 3, 10, 7]
+
+
+class PatternReader:
+    """In-memory nd2reader whose frames encode their (v, c, t) coordinates"""
+
+    def __init__(self, axes):
+        self.axes = axes + ['x', 'y']
+
+    def get_frame_2D(self, c=0, t=0, z=0, x=0, y=0, v=0):
+        return np.arange(16 * 12, dtype=np.uint16).reshape(12, 16) + 1000 * v + 100 * c + t
+
+    def __getitem__(self, index):
+        return self.get_frame_2D(t=index)
+
+
+def get_wrapper(monkeypatch, axes):
+    monkeypatch.setattr(nd2reader, 'ND2Reader', lambda input_file: PatternReader(axes))
+    return ND2Wrapper('pattern.nd2')
+
+
+def test_frame_reader_compiled_once(monkeypatch):
+    compiled = []
+    compile_frame_reader = ND2Wrapper.compile_frame_reader
+    monkeypatch.setattr(ND2Wrapper, 'compile_frame_reader',
+                        lambda self: compiled.append(self) or compile_frame_reader(self))
+    nd2_wrapper = get_wrapper(monkeypatch, ['v', 'c', 't'])
+    read_image = nd2_wrapper.get_series_reader(1, 1, ROI)
+    for timepoint in range(5):
+        nd2_wrapper.get_image(1, 0, timepoint)
+        read_image(timepoint)
+    assert compiled == [nd2_wrapper]
+
+
+def test_get_image_matches_legacy_dispatch(monkeypatch):
+    for axes in AXES:
+        nd2_wrapper = get_wrapper(monkeypatch, axes)
+        for roi in [None, ROI]:
+            for [multipoint, channel, timepoint] in [[0, 0, 0], [1, 2, 3], [2, 1, 5]]:
+                expected = legacy_get_image(nd2_wrapper.nd2_reader, multipoint, channel, timepoint, roi=roi)
+                assert np.array_equal(nd2_wrapper.get_image(multipoint, channel, timepoint, roi), expected), \
+                    f"axes {axes} roi {roi} frame {[multipoint, channel, timepoint]}"
+                assert np.array_equal(nd2_wrapper.get_series_reader(multipoint, channel, roi)(timepoint), expected)
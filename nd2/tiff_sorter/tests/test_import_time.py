@@ -0,0 +1,41 @@
+# Startup time of the command line: imports arguments.cli in a fresh interpreter with -X importtime, checks the
+# cumulative import time against a budget and that no heavy library is loaded before a use-case needs it
+# usage (from tiff_sorter directory):
+#   python -m pytest tests/test_import_time.py  or  python tests/test_import_time.py
+import os
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET_SEC = 1.0
+HEAVY_MODULES = ['tkinter', 'tkinterdnd2', 'matplotlib', 'matlab', 'scipy', 'nd2reader', 'pims', 'nd2', 'zarr',
+                 'numcodecs', 'h5py', 'tifffile', 'tqdm', 'PIL']
+TIFF_SORTER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_import_times(module):
+    """{imported module: cumulative import time in seconds} of a fresh interpreter importing module"""
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"], cwd=TIFF_SORTER_DIR,
+                            capture_output=True, text=True, check=True)
+    res = {}
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if line.startswith('import time:') and '|' in line:
+            [_, cumulative, name] = line[len('import time:'):].split('|')
+            if cumulative.strip().isdigit():
+                res[name.strip()] = int(cumulative) / 1e6
+    return res
+
+
+def test_cli_import_time():
+    import_times = get_import_times('arguments.cli')
+    assert import_times['arguments.cli'] < IMPORT_TIME_BUDGET_SEC, \
+        f"arguments.cli imported in {import_times['arguments.cli']:.3f} seconds"
+    loaded = sorted(module for module in HEAVY_MODULES if module in import_times)
+    assert loaded == [], f"arguments.cli imports {loaded}"
+
+
+if __name__ == "__main__":
+    import_times = get_import_times('arguments.cli')
+    print(f"arguments.cli: {import_times['arguments.cli']:.3f} seconds (budget {IMPORT_TIME_BUDGET_SEC} seconds)")
+    for name, seconds in sorted(import_times.items(), key=lambda entry: -entry[1])[:15]:
+        print(f"  {name} : {seconds:.3f} seconds")
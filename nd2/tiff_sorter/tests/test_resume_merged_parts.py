@@ -0,0 +1,100 @@
+# Resume of a split series: runs the parts of a series on a synthetic nd2 reader, merges them, then resumes the
+# run, the parts and the merge must be skipped and the merged outputs kept
+# usage (from tiff_sorter directory):
+#   python -m pytest tests/test_resume_merged_parts.py
+import json
+import os
+import time
+import numpy as np
+import h5py
+from nd2_tools import nd2_wrapper_factory
+from nd2_tools.nd2_reader_backend import ND2ReaderBackend
+from arguments.arguments import Arguments
+from config.settings import Settings
+from profiling.profiler import Profiler
+from works import nd2_worker
+from works.nd2_worker import ND2Worker
+from works.run_workers_thread import RunWorkersThread
+from tests.no_report_strategy import NoReportStrategy
+
+TIMEPOINTS = 16
+PARTS = [[0, 8], [8, 16]]
+PIV_PARAMS = {'clahe': 0, 'clahesize': 50, 'highp': 0, 'highpsize': 15, 'intenscap': 0, 'wienerwurst': 0,
+              'wienerwurstsize': 3, 'minintens': 0, 'maxintens': 1, 'interrogationarea': 32, 'step': 16,
+              'subpixfinder': 1, 'passes': 1, 'int2': 16, 'int3': 16, 'int4': 16, 'imdeform': '*linear',
+              'repeat': 0, 'mask_auto': 0, 'do_linear_correlation': 0, 'repeat_last_pass': 0,
+              'delta_diff_min': 0.025}
+
+
+class SyntheticReaderBackend(ND2ReaderBackend):
+    """A single 64x64 series whose frames shift a random pattern by a pixel per timepoint"""
+
+    def get_multipoints_number(self):
+        return 1
+
+    def get_channels_number(self):
+        return 1
+
+    def get_timepoints(self):
+        return TIMEPOINTS
+
+    def get_channel_names(self):
+        return ['c0']
+
+    def get_image(self, multipoint, channel, timepoint, roi=None):
+        pattern = np.random.default_rng(0).random((64, 64))
+        return (np.roll(pattern, timepoint, axis=1) * 1000).astype(np.uint16)
+
+    def close(self):
+        pass
+
+
+def run_split_series(output_dir, resume):
+    """Runs the parts of the series then merges them, returns the part results"""
+    arguments = Arguments.instance()
+    arguments.set(os.path.join(output_dir, 'input.nd2'), reader_backend='synthetic',
+                  matlab_output_dir=os.path.join(output_dir, 'matlab'),
+                  piv_params_file=os.path.join(output_dir, 'piv_params.json'),
+                  calibration_file=os.path.join(output_dir, 'calibration.json'), piv_engine='numpy',
+                  piv_output_format='mat73', z_axis_profile_output_dir=os.path.join(output_dir, 'z_axis_profile'),
+                  checkpoint=True, resume=resume)
+    series_results = []
+    for part in PARTS:
+        worker = ND2Worker(0, 0, NoReportStrategy(), part=part)
+        worker.run()
+        series_results.append({'multipoint': 0, 'channel': 0, 'part': part, 'completed': worker.is_completed(),
+                               'z_axis_profile_results': worker.get_z_axis_profile_results()})
+    run_workers_thread = RunWorkersThread([[0, 0, part] for part in PARTS], None, None)
+    try:
+        merged_results = run_workers_thread.merge_series_parts(series_results, [])
+    finally:
+        run_workers_thread.progress_counters.close()
+    return series_results, merged_results
+
+
+def test_resume_merged_parts(tmp_path, monkeypatch):
+    # the singletons and registries the run uses are restored once the test ends
+    monkeypatch.setitem(nd2_wrapper_factory.READER_BACKENDS, 'synthetic', SyntheticReaderBackend)
+    monkeypatch.setattr(nd2_worker, 'get_experiment_interval_ms', lambda input_file: 1000)
+    monkeypatch.setattr(Arguments, '_instance', None)
+    monkeypatch.setattr(Profiler, '_instance', None)
+    monkeypatch.setitem(Settings.instance().data, 'checkpoint_interval', 4)
+    Profiler.instance().start(time.time())
+    output_dir = str(tmp_path)
+    with open(os.path.join(output_dir, 'piv_params.json'), 'w') as f:
+        json.dump(PIV_PARAMS, f)
+    with open(os.path.join(output_dir, 'calibration.json'), 'w') as f:
+        json.dump({'time_step': 1, 'pixel_size_um': 1, 'mag': 1}, f)
+    [_, merged_results] = run_split_series(output_dir, resume=False)
+    matlab_worker = ND2Worker(0, 0, NoReportStrategy())
+    merged_file = matlab_worker.get_matlab_output_file()
+    assert all(not os.path.exists(matlab_worker.get_matlab_part_file(part)) for part in PARTS)
+    with h5py.File(merged_file, 'r') as f:
+        merged_u = f['u'][()]
+    assert merged_u.shape[0] == TIMEPOINTS - 1
+
+    [series_results, resumed_results] = run_split_series(output_dir, resume=True)
+    assert all(series_result['completed'] for series_result in series_results)
+    with h5py.File(merged_file, 'r') as f:
+        assert np.array_equal(f['u'][()], merged_u)
+    assert np.array_equal(resumed_results[0]['z_axis_profile'], merged_results[0]['z_axis_profile'])
@@ -0,0 +1,112 @@
+# Writers of a single (multipoint, channel) image series to tiff
+from abc import ABC, abstractmethod
+import json
+import os
+import time
+import tifffile
+from profiling.profiler import Profiler
+
+
+class FrameWriter(ABC):
+    # whether write() may be called for different frames from several threads at once
+    concurrent_writes = True
+
+    def __init__(self, report_strategy, compression_options=None):
+        """compression_options: tifffile write arguments - compression, compressionargs, predictor, tile, maxworkers"""
+        self.report_strategy = report_strategy
+        self.compression_options = {} if compression_options is None else compression_options
+
+    @abstractmethod
+    def write(self, frame_idx, image):
+        pass
+
+    def get_resume_frame(self):
+        """Frames before it are on disk, a resumed run may restart the series from there"""
+        return 0
+
+    def close(self):
+        pass
+
+
+class TiffFilesWriter(FrameWriter):
+    """Writes every frame to its own tiff file, channel_dir/img_0000.tif, channel_dir/img_0001.tif..."""
+
+    def __init__(self, channel_dir, report_strategy, compression_options=None):
+        super().__init__(report_strategy, compression_options)
+        self.channel_dir = channel_dir
+        self.written_frames = 0
+
+    def write(self, frame_idx, image):
+        # Save as TIFF - raw pixel data, no scaling or color mapping
+        output_path = os.path.join(self.channel_dir, f"img_{frame_idx:04d}.tif")
+        write_start = time.time()
+        # an interrupted write never leaves a truncated img_*.tif behind
+        tifffile.imwrite(output_path + '.partial', image, photometric='minisblack', **self.compression_options)
+        os.replace(output_path + '.partial', output_path)
+        Profiler.instance().inc('write', time.time() - write_start)
+        self.written_frames = frame_idx + 1
+        Profiler.instance().inc_metric('tiff_raw_bytes', image.nbytes)
+        Profiler.instance().inc_metric('tiff_file_bytes', os.path.getsize(output_path))
+        self.report_strategy.write_progress()
+
+    def get_resume_frame(self):
+        return self.written_frames
+
+
+class TiffStackWriter(FrameWriter):
+    """
+    Streams all frames of a series into a single BigTIFF file, one page per frame.
+    The first page holds the description of the whole (frames, y, x) series - OME-XML when ome is set, tifffile
+    shaped json otherwise - so readers open the file as one series.
+    When contiguous is set, pixel data of all pages are stored back to back and the file can be memory-mapped
+    (e.g. tifffile.memmap).
+    The stack is written to output_file.partial and renamed on close once all frames are written, a series is
+    never resumed midway.
+    """
+    concurrent_writes = False
+
+    def __init__(self, output_file, frames, report_strategy, ome=False, contiguous=False, compression_options=None):
+        super().__init__(report_strategy, compression_options)
+        self.output_file = output_file
+        self.frames = frames
+        self.ome = ome
+        self.contiguous = contiguous
+        self.tiff_writer = tifffile.TiffWriter(output_file + '.partial', bigtiff=True)
+        self.description = None
+        self.written_frames = 0
+
+    def get_description(self, image):
+        shape = (self.frames,) + image.shape
+        res = None
+        if self.ome:
+            ome_xml = tifffile.OmeXml()
+            ome_xml.addimage(image.dtype, shape, (self.frames, 1, 1) + image.shape + (1,), axes='TYX')
+            res = ome_xml.tostring()
+        else:
+            res = json.dumps({'shape': list(shape), 'axes': 'TYX'})
+        return res
+
+    def write(self, frame_idx, image):
+        write_start = time.time()
+        description = None
+        if self.description is None:
+            self.description = self.get_description(image)
+            description = self.description
+        self.tiff_writer.write(image, photometric='minisblack', contiguous=self.contiguous,
+                               description=description, metadata=None, **self.compression_options)
+        Profiler.instance().inc('write', time.time() - write_start)
+        Profiler.instance().inc_metric('tiff_raw_bytes', image.nbytes)
+        self.written_frames += 1
+        self.report_strategy.write_progress()
+
+    def close(self):
+        self.tiff_writer.close()
+        if self.written_frames != self.frames:
+            raise RuntimeError(f"{self.output_file}.partial holds {self.written_frames} of {self.frames} frames, "
+                               f"the stack is not complete")
+        os.replace(self.output_file + '.partial', self.output_file)
+        Profiler.instance().inc_metric('tiff_file_bytes', os.path.getsize(self.output_file))
+
+
+def get_tiff_stack_file(output_dir, series_name, ome=False):
+    return os.path.join(output_dir, series_name + ('.ome.tif' if ome else '.tif'))
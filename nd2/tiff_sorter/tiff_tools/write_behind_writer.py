@@ -0,0 +1,73 @@
+import queue
+import threading
+import time
+from profiling.profiler import Profiler
+from tiff_tools.tiff_writers import FrameWriter
+
+
+class WriteBehindWriter(FrameWriter):
+    """
+    Hands frames to writer threads through a bounded queue, so reading the next frames overlaps writing the
+    previous ones.
+    write() blocks while queue_size frames are pending, a slow disk slows the reader down instead of
+    accumulating frames in memory.
+    Writers that must receive frames in order (concurrent_writes is False) get a single writer thread.
+    """
+
+    def __init__(self, frame_writer, writer_threads, queue_size):
+        super().__init__(frame_writer.report_strategy)
+        self.frame_writer = frame_writer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        # frames are written out of order by several threads, resume_frame is the first frame not written yet
+        self.lock = threading.Lock()
+        self.resume_frame = None
+        self.written = set()
+        if frame_writer.concurrent_writes is False:
+            writer_threads = 1
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(writer_threads)]
+        for thread in self.threads:
+            thread.start()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            # after a failure keep draining the queue so the reader never blocks
+            if self.error is None:
+                try:
+                    frame_idx, image = item
+                    self.frame_writer.write(frame_idx, image)
+                    self.set_written(frame_idx)
+                except Exception as e:
+                    self.error = e
+
+    def set_written(self, frame_idx):
+        with self.lock:
+            self.written.add(frame_idx)
+            while self.resume_frame in self.written:
+                self.written.remove(self.resume_frame)
+                self.resume_frame += 1
+
+    def get_resume_frame(self):
+        # the wrapped writer decides whether it can resume at all (a tiff stack can't)
+        return 0 if self.resume_frame is None else min(self.resume_frame, self.frame_writer.get_resume_frame())
+
+    def write(self, frame_idx, image):
+        if self.error is not None:
+            raise self.error
+        if self.resume_frame is None:
+            self.resume_frame = frame_idx
+        wait_start = time.time()
+        self.queue.put((frame_idx, image))
+        Profiler.instance().inc('write_queue_wait', time.time() - wait_start)
+
+    def close(self):
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.frame_writer.close()
+        if self.error is not None:
+            raise self.error
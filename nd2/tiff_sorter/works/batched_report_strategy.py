@@ -0,0 +1,64 @@
+from abc import abstractmethod
+from works.report_strategy import ReportStrategy
+from config.settings import Settings
+import threading
+import time
+
+
+class BatchedReportStrategy(ReportStrategy):
+    """
+    Counts progress locally and publishes the {title: count} batch at most every progress_flush_interval_ms
+    (default 200) or progress_flush_frames counts (default 256), flush publishes what is left
+    """
+
+    def __init__(self):
+        settings = Settings.instance()
+        flush_interval_ms = settings.get('progress_flush_interval_ms')
+        self.flush_interval = (200 if flush_interval_ms is None else float(flush_interval_ms)) / 1000
+        flush_frames = settings.get('progress_flush_frames')
+        self.flush_frames = 256 if flush_frames is None else int(flush_frames)
+        self.counts = {}
+        self.pending = 0
+        self.last_flush_time = time.monotonic()
+        # write behind threads report writes while the worker thread reports reads
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def publish(self, counts):
+        pass
+
+    def add(self, progress_type):
+        with self.lock:
+            self.counts[progress_type] = self.counts.get(progress_type, 0) + 1
+            self.pending += 1
+            if self.pending >= self.flush_frames or time.monotonic() - self.last_flush_time >= self.flush_interval:
+                self.publish_counts()
+
+    def publish_counts(self):
+        if self.pending > 0:
+            self.publish(self.counts)
+            self.counts = {}
+            self.pending = 0
+        self.last_flush_time = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self.publish_counts()
+
+    def read_progress(self):
+        self.add('Read')
+
+    def write_progress(self):
+        self.add('Write')
+
+    def matlab_progress(self):
+        self.add('Pivlab calls')
+
+    def mean_progress(self):
+        self.add('Mean')
+
+    def mean_write_progress(self):
+        self.add('Mean Write')
+
+    def zarr_write_progress(self):
+        self.add('Zarr Write')
@@ -0,0 +1,223 @@
+# Consumers of the decoded frames of a (multipoint, channel) series
+# The series is read once and every frame is pushed to all enabled consumers
+from abc import ABC, abstractmethod
+import numpy as np
+from nd2_tools.nd2_reader_backend import get_frames_block_stats, concatenate_blocks_stats
+
+
+class FrameConsumer(ABC):
+
+    @abstractmethod
+    def consume(self, frame_idx, frame):
+        pass
+
+    def get_resume_frame(self):
+        """Outputs of the frames before it are on disk, 0 when the consumer can't resume a series midway"""
+        return 0
+
+    def close(self):
+        pass
+
+
+class FrameWriterConsumer(FrameConsumer):
+    """Passes frames to a tiff_tools.tiff_writers.FrameWriter"""
+
+    def __init__(self, frame_writer):
+        self.frame_writer = frame_writer
+
+    def consume(self, frame_idx, frame):
+        self.frame_writer.write(frame_idx, frame)
+
+    def get_resume_frame(self):
+        return self.frame_writer.get_resume_frame()
+
+    def close(self):
+        self.frame_writer.close()
+
+
+class FrameRangeConsumer(FrameConsumer):
+    """
+    Passes the frames before stop to consumer.
+    A part of a series also reads the first frames of the next part, only to complete its last PIV pairs.
+    """
+
+    def __init__(self, consumer, stop):
+        self.consumer = consumer
+        self.stop = stop
+
+    def consume(self, frame_idx, frame):
+        if frame_idx < self.stop:
+            self.consumer.consume(frame_idx, frame)
+
+    def get_resume_frame(self):
+        return self.consumer.get_resume_frame()
+
+    def close(self):
+        self.consumer.close()
+
+
+class ZAxisProfileConsumer(FrameConsumer):
+    """
+    Gathers block_size frames into a (block_size, y, x) stack and reduces it to per frame statistics,
+    see get_frames_block_stats. get_results returns {stat: np.ndarray of all frames} once closed.
+    """
+
+    def __init__(self, report_strategy, block_size, stats=('mean',)):
+        self.report_strategy = report_strategy
+        self.block_size = block_size
+        self.stats = stats
+        self.block = None
+        self.block_frames = 0
+        self.blocks_stats = []
+        self.results = None
+
+    def reduce_block(self):
+        if self.block_frames > 0:
+            self.blocks_stats.append(get_frames_block_stats(self.block[:self.block_frames], self.stats))
+            for _ in range(self.block_frames):
+                self.report_strategy.mean_progress()
+        self.block_frames = 0
+
+    def consume(self, frame_idx, frame):
+        if self.block is None:
+            self.block = np.empty((self.block_size,) + frame.shape, dtype=frame.dtype)
+        self.block[self.block_frames] = frame
+        self.block_frames += 1
+        if self.block_frames == self.block_size:
+            self.reduce_block()
+
+    def close(self):
+        self.reduce_block()
+        self.results = concatenate_blocks_stats(self.blocks_stats, self.stats)
+
+    def get_results(self):
+        return self.results
+
+
+class PivConsumer(FrameConsumer):
+    """
+    Runs PIV on every pair of frames k and k + pair_gap.
+    Frames are sent to MATLAB batch_size at a time and only once, MATLAB keeps the preprocessed last frame
+    of the series (series_key) to pair it with the first frame of the next batch. With pair_gap > 1 frames
+    k, k + pair_gap, k + 2 * pair_gap... form their own series, pairs of a batch are then merged by pair index.
+    Results are kept in memory, or appended to results_writer (e.g. MatV73Writer) as they arrive.
+    A part of a series starting at first_frame writes pairs first_frame, first_frame + 1... to results_writer.
+    A resumed series starts at frame n with pair n, results_writer already holds the pairs before.
+    """
+
+    def __init__(self, pivlab_stream_processor, piv_params, report_strategy, series_key, batch_size=1,
+                 results_writer=None, pair_gap=1, first_frame=0):
+        self.pivlab_stream_processor = pivlab_stream_processor
+        self.piv_params = piv_params
+        self.report_strategy = report_strategy
+        self.series_key = series_key
+        self.batch_size = batch_size
+        self.results_writer = results_writer
+        self.pair_gap = pair_gap
+        self.first_frame = first_frame
+        self.frames = []
+        # last frame index sent of every series of frames, None before the first batch
+        self.last_sent_frames = [None] * pair_gap
+        self.results = []
+
+    def get_chain_key(self, chain):
+        return self.series_key if self.pair_gap == 1 else f"{self.series_key}_{chain}"
+
+    def add_results(self, results):
+        for [first_frame, result] in results:
+            result['pair_index'] = first_frame
+            result['frame_indices'] = (first_frame + 1, first_frame + self.pair_gap + 1)
+            if self.results_writer is None:
+                self.results.append(result)
+            else:
+                self.results_writer.append(result)
+            self.report_strategy.matlab_progress()
+
+    def process_chain_frames(self, chain, frames):
+        """frames: [[frame_idx, frame]...] of the chain, returns [[first frame index of the pair, result]...]"""
+        chain_key = self.get_chain_key(chain)
+        frame_indices = [frame_idx for [frame_idx, _] in frames]
+        last_sent_frame = self.last_sent_frames[chain]
+        if last_sent_frame is None:
+            self.pivlab_stream_processor.start_series(chain_key, self.piv_params)
+            first_frames = frame_indices[:-1]
+        else:
+            first_frames = [last_sent_frame] + frame_indices[:-1]
+        results = self.pivlab_stream_processor.process_series_frames(chain_key, [frame for [_, frame] in frames],
+                                                                     len(first_frames))
+        self.last_sent_frames[chain] = frame_indices[-1]
+        return list(zip(first_frames, results))
+
+    def process_frames(self):
+        results = []
+        for chain in range(self.pair_gap):
+            frames = [[frame_idx, frame] for [frame_idx, frame] in self.frames if frame_idx % self.pair_gap == chain]
+            if len(frames) > 0:
+                results.extend(self.process_chain_frames(chain, frames))
+        self.add_results(sorted(results, key=lambda item: item[0]))
+        self.frames = []
+
+    def consume(self, frame_idx, frame):
+        self.frames.append([frame_idx, frame])
+        if len(self.frames) == self.batch_size:
+            self.process_frames()
+
+    def get_resume_frame(self):
+        # pairs [first_frame, n) are written, pair n is made of frames n and n + pair_gap
+        return 0 if self.results_writer is None else self.first_frame + self.results_writer.written_pairs
+
+    def close(self):
+        try:
+            self.process_frames()
+        finally:
+            for chain in range(self.pair_gap):
+                if self.last_sent_frames[chain] is not None:
+                    self.pivlab_stream_processor.end_series(self.get_chain_key(chain))
+            if self.results_writer is not None:
+                self.results_writer.close()
+
+    def get_results(self):
+        return self.results
+
+
+class CheckpointConsumer(FrameConsumer):
+    """
+    Records in the run manifest, every interval frames, the frame all consumers of the series can resume from.
+    Added after the consumers it watches.
+    """
+
+    def __init__(self, run_manifest, series_key, consumers, interval, start_frame=0):
+        self.run_manifest = run_manifest
+        self.series_key = series_key
+        self.consumers = consumers
+        self.interval = interval
+        self.resume_frame = start_frame
+
+    def consume(self, frame_idx, frame):
+        if (frame_idx + 1) % self.interval == 0:
+            resume_frame = min(consumer.get_resume_frame() for consumer in self.consumers)
+            if resume_frame > self.resume_frame:
+                self.resume_frame = resume_frame
+                self.run_manifest.save_series(self.series_key, resume_frame)
+
+
+def run_frame_consumers(read_generator, consumers, start_frame=0):
+    """
+    Pushes every frame of read_generator to all consumers, consumers are closed even on failure. Errors of
+    closing consumers are raised only when all frames were consumed, never hiding the error of a failed read.
+    """
+    consumed = False
+    try:
+        for frame_idx, frame in enumerate(read_generator, start_frame):
+            for consumer in consumers:
+                consumer.consume(frame_idx, frame)
+        consumed = True
+    finally:
+        errors = []
+        for consumer in consumers:
+            try:
+                consumer.close()
+            except Exception as e:
+                errors.append(e)
+        if errors and consumed:
+            raise errors[0]
@@ -1,19 +1,20 @@
 from works.orchestrator import Orchestrator
 from queue import Queue as ThreadQueue
-from nd2_tools.nd2_wrapper import ND2Wrapper
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
 import time
 from profiling.profiler import Profiler, get_summary_message
-from gui.progress_window import ProgressWindow
-from gui.z_axis_profile_window import ZAxisProfileWindow
-from works.run_workers_thread import RunWorkersThread
+from works.terminal_progress_reporter import TerminalProgressReporter
+from works.run_workers_thread import RunWorkersThread, get_utilization_message
 from arguments.arguments import Arguments
 import threading
+import os
 
 class MultiProcessOrchestrator(Orchestrator):
     def __init__(self):
         super().__init__()
         self.ui_queue = ThreadQueue()
-        self.nd2_wrapper = ND2Wrapper.instance(Arguments.instance().input_file)
+        arguments = Arguments.instance()
+        self.nd2_wrapper = get_nd2_wrapper(arguments.input_file, arguments.reader_backend)
         self.progress_window = None
         self.pivlab_stream_processor = None
 
@@ -28,21 +29,34 @@ class MultiProcessOrchestrator(Orchestrator):
 
     def run(self):
         Profiler.instance().start(time.time())
+        self.prepare_outputs()
         abort_event = threading.Event()
-        run_workers_thread = RunWorkersThread(self.get_multipoint_channel_generator(),
+        run_workers_thread = RunWorkersThread(self.get_scheduled_tasks(os.cpu_count()),
                                               self.ui_queue,
                                               abort_event)
-        run_workers_thread.start()
-        self.progress_window = ProgressWindow(self.progress_data, self.progress_order, self.ui_queue)
-        self.progress_window.start()
-        if self.progress_window.aborted:
-            print('aborted')
-            abort_event.set()
-            run_workers_thread.terminate()
-            run_workers_thread.join()
-            return
-        run_workers_thread.join()
         arguments = Arguments.instance()
+        if arguments.headless:
+            # no window to serve, the pool is driven from the main thread
+            progress_reporter = TerminalProgressReporter(self.progress_data, self.progress_order,
+                                                         run_workers_thread.progress_counters)
+            progress_reporter.start()
+            run_workers_thread.run()
+            progress_reporter.stop()
+        else:
+            from gui.progress_window import ProgressWindow
+            run_workers_thread.start()
+            self.progress_window = ProgressWindow(self.progress_data, self.progress_order, self.ui_queue,
+                                                  run_workers_thread.progress_counters)
+            self.progress_window.start()
+            if self.progress_window.aborted:
+                print('aborted')
+                abort_event.set()
+                run_workers_thread.terminate()
+                run_workers_thread.join()
+                run_workers_thread.progress_counters.close()
+                return
+            run_workers_thread.join()
+        run_workers_thread.progress_counters.close()
         if arguments.z_axis_profile_single_output_file:
             z_axis_profile_data = self.get_z_axis_profile_data(run_workers_thread.mean_results)
             self.save_z_axis_profile_to_single_file(z_axis_profile_data)
@@ -52,7 +66,9 @@ class MultiProcessOrchestrator(Orchestrator):
             print('Additional processes profiling data:')
             for result in run_workers_thread.profiler_results:
                 print(get_summary_message(result) + '\n')
+            print(get_utilization_message(run_workers_thread.utilization))
         if arguments.z_axis_profile_plot is True:
+            from gui.z_axis_profile_window import ZAxisProfileWindow
             z_axis_profile_window = ZAxisProfileWindow(run_workers_thread.mean_results, arguments.input_file)
             z_axis_profile_window.start()
 
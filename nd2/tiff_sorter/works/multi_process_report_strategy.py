@@ -1,22 +0,0 @@
-from works.report_strategy import ReportStrategy
-import os
-
-class MultiProcessReportStrategy(ReportStrategy):
-
-    def __init__(self, queue):
-        self.queue = queue
-
-    def read_progress(self):
-        self.queue.put({'type': 'progress', 'progress_type': 'Read'})
-
-    def write_progress(self):
-        self.queue.put({'type': 'progress', 'progress_type': 'Write'})
-
-    def matlab_progress(self):
-        self.queue.put({'type': 'progress', 'progress_type': 'Pivlab calls'})
-
-    def mean_progress(self):
-        self.queue.put({'type': 'progress', 'progress_type': 'Mean'})
-
-    def mean_write_progress(self):
-        self.queue.put({'type': 'progress', 'progress_type': 'Mean Write'})
\ No newline at end of file
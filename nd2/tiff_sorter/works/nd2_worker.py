@@ -1,27 +1,52 @@
-from nd2_tools.nd2_wrapper import ND2Wrapper
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
 from nd2_tools.nd2_wrapper import get_experiment_interval_ms
-from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor
-from matlab_integration.save_to_mat import save_results_to_mat
+from piv_tools.piv_processor_factory import get_piv_processor
+from piv_tools.piv_params import validate_piv_params
 from arguments.arguments import Arguments
+from config.settings import Settings
+from csv_utils.z_axis_profile import generate_z_profile_csv
+from works.frame_consumers import (FrameWriterConsumer, FrameRangeConsumer, ZAxisProfileConsumer, PivConsumer,
+                                   CheckpointConsumer, run_frame_consumers)
+from works.run_manifest import RunManifest, write_atomically
 import json
-import collections
 import os
+import numpy as np
 import csv_utils
 import io
 import traceback
 
 
 class ND2Worker:
-    def __init__(self, multipoint, channel, report_strategy, pivlab_stream_processor=None):
+    def __init__(self, multipoint, channel, report_strategy, pivlab_stream_processor=None, part=None):
+        """
+        part: [start, stop) frames of the processed timepoints when the series is split between workers,
+        None handles the whole series. Outputs of the parts are merged by merge_parts.
+        """
         self.multipoint = multipoint
         self.channel = channel
+        self.part = part
         self.report_strategy = report_strategy
-        self.rw_generator = None
-        self.matlab_generator = None
-        self.mean_generator = None
-        self.nd2_wrapper = ND2Wrapper.instance(Arguments.instance().input_file)
+        self.read_generator = None
+        self.consumers = []
+        self.z_axis_profile_consumer = None
+        self.piv_consumer = None
+        arguments = Arguments.instance()
+        self.nd2_wrapper = get_nd2_wrapper(arguments.input_file, arguments.reader_backend)
+        self.timepoints = arguments.get_timepoints_range(self.nd2_wrapper.get_timepoints())
         self.pivlab_stream_processor = pivlab_stream_processor
         self.mean_results = None
+        self.z_axis_profile_results = None
+        self.completed = False
+        [self.start, self.stop] = [0, len(self.timepoints)] if part is None else part
+        self.series_key = f"multipoint_{multipoint}_channel_{channel}"
+        # a split series is done once its parts are merged, the record of the whole series tells so
+        self.whole_series_key = self.series_key
+        if part is not None:
+            self.series_key += f"_frames_{self.start}-{self.stop}"
+        # no run manifest is written unless --checkpoint / --resume is selected
+        self.run_manifest = None
+        if arguments.is_checkpoint():
+            self.run_manifest = RunManifest(arguments.get_run_manifest_dir(), arguments.get_run_config())
 
     def get_multipoint(self):
         return self.multipoint
@@ -29,99 +54,222 @@ class ND2Worker:
     def get_channel(self):
         return self.channel
 
-    def prepare_generator(self):
+    def get_frame_writer(self, series_name):
+        from tiff_tools.tiff_writers import TiffFilesWriter, TiffStackWriter, get_tiff_stack_file
+        from tiff_tools.write_behind_writer import WriteBehindWriter
+        arguments = Arguments.instance()
+        res = None
+        if arguments.is_tiff_stack():
+            os.makedirs(arguments.output_dir, exist_ok=True)
+            output_file = get_tiff_stack_file(arguments.output_dir, series_name, arguments.is_ome_tiff())
+            res = TiffStackWriter(output_file, len(self.timepoints), self.report_strategy,
+                                  ome=arguments.is_ome_tiff(), contiguous=arguments.tiff_contiguous,
+                                  compression_options=arguments.get_tiff_compression_options())
+        else:
+            channel_dir_full = os.path.join(arguments.output_dir, series_name)
+            os.makedirs(channel_dir_full, exist_ok=True)
+            res = TiffFilesWriter(channel_dir_full, self.report_strategy, arguments.get_tiff_compression_options())
+        if arguments.writer_threads > 0:
+            queue_size = Settings.instance().get('write_queue_size')
+            res = WriteBehindWriter(res, arguments.writer_threads, 32 if queue_size is None else int(queue_size))
+        return res
+
+    def get_piv_params(self):
+        arguments = Arguments.instance()
+        calibration = None
+        with open(arguments.calibration_file, 'r') as calibration_file:
+            calibration = json.load(calibration_file)
+        piv_params = None
+        with open(arguments.piv_params_file, 'r') as piv_params_file:
+            piv_params = json.load(piv_params_file)
+        piv_params['cal_fact'] = calibration['pixel_size_um'] / calibration['mag'] / calibration['time_step']
+        validate_piv_params(piv_params)
+        return piv_params
+
+    def get_piv_pairs_number(self):
+        """PIV pairs starting in [start, stop), the last pairs end in the first frames of the next part"""
+        pair_gap = Arguments.instance().piv_pair_gap
+        return max(min(self.stop, len(self.timepoints) - pair_gap) - self.start, 0)
+
+    def get_matlab_part_file(self, part):
+        return self.get_matlab_output_file() + f".frames_{part[0]}-{part[1]}"
+
+    def prepare_consumers(self, start_frame=0):
+        """Reads the series once from start_frame, every enabled use-case consumes the same decoded frames"""
         roi = None
         arguments = Arguments.instance()
         if arguments.roi is not None:
             key = f"{self.multipoint}_{self.channel}"
             if key in arguments.roi.keys():
                 roi = arguments.roi[key]
-        self.rw_generator = self.nd2_wrapper.nd2_images_reader_generator(self.multipoint,
-                                                                         self.channel, roi,
-                                                                         self.report_strategy)
+        read_stop = self.stop + (arguments.piv_pair_gap if arguments.is_pivlab() else 0)
+        self.read_generator = self.nd2_wrapper.nd2_images_reader_generator(self.multipoint,
+                                                                           self.channel, roi,
+                                                                           self.report_strategy,
+                                                                           self.timepoints[start_frame:read_stop])
+        self.consumers = []
         if arguments.is_tiff_write():
             channel_names = self.nd2_wrapper.get_channel_names()
-            channel_dir = f"multipoint_{self.multipoint}_channel_{channel_names[self.channel]}"
-            channel_dir_full = os.path.join(arguments.output_dir, channel_dir)
-            os.makedirs(channel_dir_full, exist_ok=True)
-
-            self.rw_generator = self.nd2_wrapper.nd2_images_writer_generator(self.rw_generator,
-                                                                             channel_dir_full,
-                                                                             self.report_strategy)
-        arguments = Arguments.instance()
+            series_name = (f"multipoint_{self.multipoint}_channel_{channel_names[self.channel]}" +
+                           arguments.get_timepoints_suffix(self.nd2_wrapper.get_timepoints()))
+            self.consumers.append(FrameWriterConsumer(self.get_frame_writer(series_name)))
+        if arguments.is_zarr_write():
+            from zarr_tools.zarr_writer import ZarrSeriesWriter, get_zarr_store_path
+            store_path = get_zarr_store_path(arguments.zarr_output_dir, arguments.input_file,
+                                             arguments.get_timepoints_suffix(self.nd2_wrapper.get_timepoints()))
+            zarr_writer = ZarrSeriesWriter(store_path, self.multipoint, self.channel, self.report_strategy)
+            self.consumers.append(FrameWriterConsumer(zarr_writer))
+        if arguments.is_z_axis_profile():
+            block_size = Settings.instance().get('z_axis_profile_block_size')
+            self.z_axis_profile_consumer = ZAxisProfileConsumer(self.report_strategy,
+                                                                64 if block_size is None else int(block_size),
+                                                                arguments.get_z_axis_profile_stats())
+            self.consumers.append(self.z_axis_profile_consumer)
+        if read_stop > self.stop:
+            self.consumers = [FrameRangeConsumer(consumer, self.stop) for consumer in self.consumers]
         if arguments.is_pivlab():
             if self.pivlab_stream_processor is None:
-                self.pivlab_stream_processor = PIVlabStreamProcessor(self.report_strategy)
-            calibration = None
-            with open(arguments.calibration_file, 'r') as calibration_file:
-                calibration = json.load(calibration_file)
-            piv_params = None
-            with open(arguments.piv_params_file, 'r') as piv_params_file:
-                piv_params = json.load(piv_params_file)
-            piv_params['cal_fact'] = calibration['pixel_size_um'] / calibration['mag'] / calibration['time_step']
-            self.matlab_generator = self.pivlab_stream_processor.process_image_generator(self.rw_generator,
-                                                                                         piv_params,
-                                                                                         self.report_strategy)
-        if arguments.is_z_axis_profile():
-            self.mean_generator = (
-                self.nd2_wrapper.nd2_z_axis_profile_generator(self.rw_generator, self.report_strategy))
+                self.pivlab_stream_processor = get_piv_processor(arguments.piv_engine, self.report_strategy)
+            batch_size = Settings.instance().get('piv_batch_size')
+            # engines are shared between processes, the key must be unique on the machine
+            series_key = f"{os.getpid()}_{self.multipoint}_{self.channel}"
+            from matlab_integration.mat_v73_writer import MatV73Writer
+            results_writer = None
+            # parts always stream their pairs to a file, merged into the selected format by merge_parts
+            if self.part is not None:
+                results_writer = MatV73Writer(self.get_matlab_part_file(self.part), self.get_piv_pairs_number(),
+                                              start_frame - self.start)
+            elif arguments.piv_output_format == 'mat73':
+                results_writer = MatV73Writer(self.get_matlab_output_file(), self.get_piv_pairs_number(),
+                                              start_frame)
+            self.piv_consumer = PivConsumer(self.pivlab_stream_processor, self.get_piv_params(),
+                                            self.report_strategy, series_key,
+                                            16 if batch_size is None else int(batch_size), results_writer,
+                                            arguments.piv_pair_gap, self.start)
+            self.consumers.append(self.piv_consumer)
+        if self.run_manifest is not None:
+            checkpoint_interval = Settings.instance().get('checkpoint_interval')
+            self.consumers.append(CheckpointConsumer(self.run_manifest, self.series_key, list(self.consumers),
+                                                     256 if checkpoint_interval is None else int(checkpoint_interval),
+                                                     start_frame))
 
-    def save(self, matlab_results):
+    def get_frames_name(self):
+        """Number of processed frames and the processed part of the time axis, part of the output file names"""
+        suffix = Arguments.instance().get_timepoints_suffix(self.nd2_wrapper.get_timepoints())
+        return f"{len(self.timepoints)}_frames{suffix}"
+
+    def get_matlab_output_file(self):
         matlab_output_dir = Arguments.instance().matlab_output_dir
         os.makedirs(matlab_output_dir, exist_ok=True)
-        frames = self.nd2_wrapper.get_timepoints()
         channel_name = self.nd2_wrapper.get_channel_names()[self.channel]
-        matlab_output_file = (matlab_output_dir + "\\" +
-                              f"multipoint_{self.multipoint}_channel_{channel_name}_{frames}_frames.mat")
-        save_results_to_mat(matlab_results, matlab_output_file)
+        return (matlab_output_dir + "\\" +
+                f"multipoint_{self.multipoint}_channel_{channel_name}_{self.get_frames_name()}.mat")
+
+    def save(self, matlab_results):
+        from matlab_integration.save_to_mat import save_results_to_mat
+        save_results_to_mat(matlab_results, self.get_matlab_output_file())
 
-    def save_mean(self, mean_results):
+    def save_mean(self, mean_results, stats_results=None):
         mean_output_dir = Arguments.instance().z_axis_profile_output_dir
         os.makedirs(mean_output_dir, exist_ok=True)
         channel_name = self.nd2_wrapper.get_channel_names()[self.channel]
-        frames = self.nd2_wrapper.get_timepoints()
         output_file = (mean_output_dir + "\\" +
-                       f"z_profile_multipoint_{self.multipoint}_channel_{channel_name}_{frames}_frames.csv")
+                       f"z_profile_multipoint_{self.multipoint}_channel_{channel_name}_{self.get_frames_name()}.csv")
         experiment_interval_sec = get_experiment_interval_ms(self.nd2_wrapper.get_input_file()) / 1000.0
-        csv_content = generate_z_profile_csv(mean_results, experiment_interval_sec)
-        with open(output_file, "w", newline="") as f:
-            f.write(csv_content)
-
-    def run_matlab(self):
-        results = []
-        try:
-            # Collect results as they're generated
-            results = list(self.matlab_generator)
-            # write results to file
-            self.save(results)
-        except KeyboardInterrupt:
-            print("\nProcessing interrupted by user")
-
-    def run_tiff_extraction(self):
-        collections.deque(self.rw_generator, maxlen=0)
+        csv_content = generate_z_profile_csv(mean_results, experiment_interval_sec, stats_results)
+        write_atomically(output_file, lambda f: f.write(csv_content))
 
     def get_mean_results(self):
         return self.mean_results
 
-    def run_z_axis_profile(self):
-        self.mean_results = list(self.mean_generator)
+    def is_completed(self):
+        return self.completed
+
+    def get_z_axis_profile_results(self):
+        return self.z_axis_profile_results
+
+    def save_z_axis_profile(self, z_axis_profile_results):
+        self.z_axis_profile_results = z_axis_profile_results
+        self.mean_results = self.z_axis_profile_results['mean']
         arguments = Arguments.instance()
         if arguments.z_axis_profile_output_dir is not None and arguments.z_axis_profile_single_output_file is False:
-            self.save_mean(self.mean_results)
+            stats = arguments.get_z_axis_profile_stats()
+            self.save_mean(self.mean_results, {stat: self.z_axis_profile_results[stat] for stat in stats[1:]})
             self.report_strategy.mean_write_progress()
 
+    def resume_finished_series(self):
+        """True when a previous run completed the series, its z-axis profile is loaded from the manifest"""
+        res = self.run_manifest.is_series_done(self.series_key)
+        if res and Arguments.instance().is_z_axis_profile():
+            self.z_axis_profile_results = self.run_manifest.load_series_results(self.series_key)
+            res = self.z_axis_profile_results is not None
+            if res:
+                self.mean_results = self.z_axis_profile_results['mean']
+        return res
+
+    def merge_parts(self, parts, parts_z_axis_profile_results):
+        """
+        Merges the outputs of the parts of the series, in frames order.
+        Frames of the parts were written to disjoint tiff files / zarr chunks, z-axis profile results are
+        concatenated and the PIV pairs files of the parts are merged into the selected PIV output format.
+        The merge is recorded as the whole series being done before the PIV part files are removed.
+        """
+        arguments = Arguments.instance()
+        if arguments.resume and self.resume_finished_series():
+            print(f"{self.series_key} merged by a previous run, skipped")
+            return
+        if arguments.is_z_axis_profile():
+            self.save_z_axis_profile({stat: np.concatenate([results[stat] for results in parts_z_axis_profile_results])
+                                      for stat in arguments.get_z_axis_profile_stats()})
+            if self.run_manifest is not None:
+                self.run_manifest.save_series_results(self.series_key, self.z_axis_profile_results)
+        part_files = []
+        if arguments.is_pivlab():
+            from matlab_integration.mat_v73_writer import read_mat_v73_results, merge_mat_v73_files
+            part_files = [self.get_matlab_part_file(part) for part in parts]
+            if arguments.piv_output_format == 'mat73':
+                merge_mat_v73_files(part_files, self.get_matlab_output_file(), self.get_piv_pairs_number())
+            else:
+                self.save([result for part_file in part_files for result in read_mat_v73_results(part_file)])
+        if self.run_manifest is not None:
+            self.run_manifest.save_series(self.series_key, self.stop, done=True)
+        for part_file in part_files:
+            os.remove(part_file)
+
     def run(self):
-        self.prepare_generator()
         arguments = Arguments.instance()
+        start_frame = self.start
+        if arguments.resume:
+            if self.part is not None and self.run_manifest.is_series_done(self.whole_series_key):
+                print(f"{self.whole_series_key} completed by a previous run, {self.series_key} skipped")
+                self.completed = True
+                return
+            if self.resume_finished_series():
+                print(f"{self.series_key} completed by a previous run, skipped")
+                self.completed = True
+                return
+            resume_frame = self.run_manifest.get_resume_frame(self.series_key)
+            start_frame = self.start if resume_frame is None else resume_frame
+        self.prepare_consumers(start_frame)
         try:
-            if arguments.is_pivlab():
-                self.run_matlab()
-            else:
-                if arguments.is_z_axis_profile() is False:
-                    self.run_tiff_extraction()
+            if self.run_manifest is not None:
+                self.run_manifest.save_series(self.series_key, start_frame)
+            run_frame_consumers(self.read_generator, self.consumers, start_frame)
+            if arguments.is_z_axis_profile():
+                if self.part is None:
+                    self.save_z_axis_profile(self.z_axis_profile_consumer.get_results())
                 else:
-                    self.run_z_axis_profile()
+                    self.z_axis_profile_results = self.z_axis_profile_consumer.get_results()
+                if self.run_manifest is not None:
+                    self.run_manifest.save_series_results(self.series_key, self.z_axis_profile_results)
+            if arguments.is_pivlab() and arguments.piv_output_format == 'mat' and self.part is None:
+                self.save(self.piv_consumer.get_results())
+            if self.run_manifest is not None:
+                self.run_manifest.save_series(self.series_key, self.stop, done=True)
+            self.completed = True
+        except KeyboardInterrupt:
+            print("\nProcessing interrupted by user")
         except Exception as e:
             # 'e' captures the error details (e.g., "division by zero")
             print(f"An unexpected error occurred: {e}")
-            traceback.print_exc()
\ No newline at end of file
+            traceback.print_exc()
@@ -1,36 +1,39 @@
 from abc import ABC, abstractmethod
-from nd2_tools.nd2_wrapper import ND2Wrapper, get_experiment_interval_ms
+from nd2_tools.nd2_wrapper import get_experiment_interval_ms
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
 from config.settings import Settings
 from arguments.arguments import Arguments
 from csv_utils.z_axis_profile import generate_z_profile_csv
+from works.run_manifest import RunManifest, write_atomically
+import math
 import os
+import shutil
 
 
 class Orchestrator(ABC):
 
     def __init__(self):
         arguments = Arguments.instance()
-        self.nd2_wrapper = ND2Wrapper(arguments.input_file)
-        self.roi_skip_empty = Settings.instance().get('roi_skip_empty') is True
+        self.nd2_wrapper = get_nd2_wrapper(arguments.input_file, arguments.reader_backend)
+        self.roi_skip_empty = Settings.instance().get('roi_skip_empty') == "true"
         [self.progress_data, self.progress_order] = self.get_progress_bars_data()
 
     def get_progress_bars_data(self):
         arguments = Arguments.instance()
-        timepoints = self.nd2_wrapper.get_timepoints()
-        multipoints = self.nd2_wrapper.get_multipoints_number()
-        if 'multipoints' in arguments.multipoints:
-            multipoints = len(arguments.multipoints)
-        channels = self.nd2_wrapper.get_channels_number()
-        if 'channels' in arguments.channels:
-            channels = len(arguments.channels)
+        timepoints = len(arguments.get_timepoints_range(self.nd2_wrapper.get_timepoints()))
+        multipoints = len(arguments.multipoints)
+        channels = len(arguments.channels)
         frames = multipoints*channels*timepoints
         data = { 'Read': {'maximum': frames, 'units': 'frames'} }
         order = ['Read']
         if arguments.is_tiff_write():
             data['Write'] = { 'maximum': frames, 'units': 'frames' }
             order.append('Write')
+        if arguments.is_zarr_write():
+            data['Zarr Write'] = { 'maximum': frames, 'units': 'frames' }
+            order.append('Zarr Write')
         if arguments.is_pivlab():
-            pairs_number = multipoints*channels*(timepoints-1)
+            pairs_number = multipoints*channels*arguments.get_piv_pairs_number(timepoints)
             data['Pivlab calls'] = { 'maximum': pairs_number, 'units': 'frame pairs' }
             order.append('Pivlab calls')
         if arguments.is_z_axis_profile():
@@ -47,7 +50,7 @@ class Orchestrator(ABC):
         res = True
         if arguments.roi is not None:
             key = f"{multipoint}_{channel}"
-            if key not in arguments.roi and self.roi_skip_empty() :
+            if key not in arguments.roi and self.roi_skip_empty:
                 res = False
         return res
 
@@ -58,16 +61,96 @@ class Orchestrator(ABC):
                 if self.should_handle_series(multipoint, channel):
                     yield [multipoint, channel]
 
+    def get_series_cost(self, multipoint, channel):
+        """Estimated work of a series, frames x frame (ROI) area"""
+        arguments = Arguments.instance()
+        frames = len(arguments.get_timepoints_range(self.nd2_wrapper.get_timepoints()))
+        frame = self.nd2_wrapper.get_image(multipoint, channel, 0, self.get_roi(multipoint, channel))
+        return frames * frame.shape[0] * frame.shape[1]
+
+    def get_series_parts(self, series_number, workers):
+        """
+        [start, stop) frame ranges every series is split to when there are fewer series than workers, [None] when
+        series are handled as a whole. A tiff stack is written by a single worker, zarr parts start on chunk
+        boundaries so two parts never write the same chunk.
+        """
+        arguments = Arguments.instance()
+        frames = len(arguments.get_timepoints_range(self.nd2_wrapper.get_timepoints()))
+        min_part_frames = Settings.instance().get('min_series_part_frames')
+        min_part_frames = 500 if min_part_frames is None else int(min_part_frames)
+        parts_number = min(math.ceil(workers / max(series_number, 1)), frames // min_part_frames)
+        res = [None]
+        if parts_number > 1 and not (arguments.is_tiff_write() and arguments.is_tiff_stack()):
+            alignment = arguments.zarr_chunks[0] if arguments.is_zarr_write() else 1
+            bounds = [round(frames * index / parts_number / alignment) * alignment for index in range(parts_number)]
+            bounds.append(frames)
+            parts = [[start, stop] for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+            if len(parts) > 1:
+                res = parts
+        return res
+
+    def get_scheduled_tasks(self, workers):
+        """[multipoint, channel, part] of the tasks to run, largest first so no long task starts last"""
+        series = list(self.get_multipoint_channel_generator())
+        frames = len(Arguments.instance().get_timepoints_range(self.nd2_wrapper.get_timepoints()))
+        costs = {f"{multipoint}_{channel}": self.get_series_cost(multipoint, channel)
+                 for [multipoint, channel] in series}
+        tasks = []
+        for part in self.get_series_parts(len(series), workers):
+            for [multipoint, channel] in series:
+                cost = costs[f"{multipoint}_{channel}"]
+                if part is not None:
+                    cost = cost * (part[1] - part[0]) / frames
+                tasks.append([cost, [multipoint, channel, part]])
+        return [task for [_, task] in sorted(tasks, key=lambda entry: -entry[0])]
+
+    def get_roi(self, multipoint, channel):
+        arguments = Arguments.instance()
+        res = None
+        if arguments.roi is not None:
+            res = arguments.roi.get(f"{multipoint}_{channel}")
+        return res
+
+    def prepare_outputs(self):
+        """Creates outputs shared by all workers before they start"""
+        arguments = Arguments.instance()
+        run_manifest_dir = arguments.get_run_manifest_dir()
+        if run_manifest_dir is not None and not arguments.resume:
+            # outputs are rewritten from scratch, records of previous runs no longer describe them
+            shutil.rmtree(run_manifest_dir, ignore_errors=True)
+        timepoints_number = self.nd2_wrapper.get_timepoints()
+        timepoints = arguments.get_timepoints_range(timepoints_number)
+        if arguments.is_zarr_write():
+            from zarr_tools.zarr_writer import create_ome_zarr_store, get_zarr_store_path
+            store_path = get_zarr_store_path(arguments.zarr_output_dir, arguments.input_file,
+                                             arguments.get_timepoints_suffix(timepoints_number))
+            # a resumed run keeps writing into the store of the interrupted run, unless the store was made with
+            # other options (e.g. chunks), the series are then all restarted and so is the store
+            if not (arguments.resume and os.path.isdir(store_path) and
+                    RunManifest(run_manifest_dir, arguments.get_run_config()).has_records()):
+                series_shapes = {}
+                dtype = None
+                for [multipoint, channel] in self.get_multipoint_channel_generator():
+                    first_image = self.nd2_wrapper.get_image(multipoint, channel, 0,
+                                                             self.get_roi(multipoint, channel))
+                    series_shapes.setdefault(multipoint, {})[channel] = first_image.shape
+                    dtype = first_image.dtype
+                os.makedirs(arguments.zarr_output_dir, exist_ok=True)
+                create_ome_zarr_store(store_path, series_shapes, timepoints, dtype,
+                                      self.nd2_wrapper.get_channel_names(), arguments.zarr_chunks,
+                                      arguments.zarr_compressor)
+
     def save_z_axis_profile_to_single_file(self, z_axis_profile_data):
-        mean_output_dir = Arguments.instance().z_axis_profile_output_dir
+        arguments = Arguments.instance()
+        mean_output_dir = arguments.z_axis_profile_output_dir
         os.makedirs(mean_output_dir, exist_ok=True)
-        frames = self.nd2_wrapper.get_timepoints()
+        timepoints_number = self.nd2_wrapper.get_timepoints()
+        frames = len(arguments.get_timepoints_range(timepoints_number))
         output_file = (mean_output_dir + "\\" +
-                       f"z_axis_profile_{frames}_frames.csv")
+                       f"z_axis_profile_{frames}_frames{arguments.get_timepoints_suffix(timepoints_number)}.csv")
         experiment_interval_sec = get_experiment_interval_ms(self.nd2_wrapper.get_input_file()) / 1000.0
         csv_content = generate_z_profile_csv(z_axis_profile_data, experiment_interval_sec)
-        with open(output_file, "w", newline="") as f:
-            f.write(csv_content)
+        write_atomically(output_file, lambda f: f.write(csv_content))
 
 
     @abstractmethod
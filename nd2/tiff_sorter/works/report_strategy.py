@@ -23,4 +23,8 @@ class ReportStrategy(ABC):
     def mean_write_progress(self):
         pass
 
+    @abstractmethod
+    def zarr_write_progress(self):
+        pass
+
 
@@ -0,0 +1,77 @@
+# Run manifest: a json file per (multipoint, channel) series, or part of a series, recording the frames whose
+# outputs are on disk. A file is written by the single worker handling the series, files are replaced atomically
+import json
+import os
+import numpy as np
+
+
+def get_run_manifest_dir(output_dir, input_file):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + '.run')
+
+
+def write_atomically(output_file, write):
+    """write(file) fills output_file + '.partial', which then replaces output_file"""
+    partial_file = output_file + '.partial'
+    with open(partial_file, 'w', newline='') as f:
+        write(f)
+    os.replace(partial_file, output_file)
+
+
+class RunManifest:
+    """
+    Every series record holds the run config (outputs and their options), the number of leading frames whose
+    outputs are complete and whether the series is done. Records of another config are ignored, so a resumed
+    run never mixes outputs of different options.
+    """
+
+    def __init__(self, manifest_dir, config):
+        self.manifest_dir = manifest_dir
+        # json round trip, tuples and lists compare equal once loaded
+        self.config = json.loads(json.dumps(config))
+        os.makedirs(manifest_dir, exist_ok=True)
+
+    def get_series_file(self, series_key, extension='.json'):
+        return os.path.join(self.manifest_dir, series_key + extension)
+
+    def load_series(self, series_key):
+        res = None
+        series_file = self.get_series_file(series_key)
+        if os.path.isfile(series_file):
+            with open(series_file, 'r') as f:
+                record = json.load(f)
+            if record.get('config') == self.config:
+                res = record
+        return res
+
+    def has_records(self):
+        """Whether any series record was written with the current config"""
+        series_keys = [os.path.splitext(name)[0] for name in os.listdir(self.manifest_dir) if name.endswith('.json')]
+        return any(self.load_series(series_key) is not None for series_key in series_keys)
+
+    def save_series(self, series_key, frames, done=False):
+        record = {'config': self.config, 'frames': frames, 'done': done}
+        write_atomically(self.get_series_file(series_key), lambda f: json.dump(record, f, indent=4))
+
+    def is_series_done(self, series_key):
+        record = self.load_series(series_key)
+        return record is not None and record['done']
+
+    def get_resume_frame(self, series_key):
+        """Frame to resume the series from, None when the series has no record"""
+        record = self.load_series(series_key)
+        return None if record is None or record['done'] else record['frames']
+
+    def save_series_results(self, series_key, results):
+        """results: {name: np.ndarray} of a finished series needed after all series end (z-axis profile)"""
+        results_file = self.get_series_file(series_key, '.npz')
+        with open(results_file + '.partial', 'wb') as f:
+            np.savez(f, **results)
+        os.replace(results_file + '.partial', results_file)
+
+    def load_series_results(self, series_key):
+        res = None
+        results_file = self.get_series_file(series_key, '.npz')
+        if os.path.isfile(results_file):
+            with np.load(results_file) as data:
+                res = {name: data[name] for name in data.files}
+        return res
@@ -1,102 +1,180 @@
 import threading
 from multiprocessing import Manager
+from multiprocessing.util import Finalize
 import os
 import time
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from queue import Empty
-from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from piv_tools.piv_processor_factory import get_piv_processor
 from works.nd2_worker import ND2Worker
-from works.multi_process_report_strategy import MultiProcessReportStrategy
-from profiling.profiler import Profiler
+from works.shared_memory_report_strategy import ProgressCounters, SharedMemoryReportStrategy
+from profiling.profiler import Profiler, add_summary_data
 from arguments.arguments import Arguments
 
-def handle_tasks(args):
-    (tasks, queue, arguments) = args
+# state of a worker process, set once by init_worker and shared by all the series the process handles
+_worker_state = {}
+
+
+def init_worker(progress_counters, arguments, engine_slots):
     Arguments.set_instance(arguments)
-    report_strategy = MultiProcessReportStrategy(queue)
     Profiler.instance().set_print_summary(False)
-    Profiler.instance().start(time.time())
-    pivlab_stream_processor = None
-    should_z_axis_profile = arguments.z_axis_profile_plot or arguments.z_axis_profile_single_output_file
-    z_axis_profile_single_output_file = arguments.z_axis_profile_single_output_file
-    mean_results = []
-    if arguments.is_pivlab():
-        pivlab_stream_processor = PIVlabStreamProcessor(report_strategy)
-    for [multipoint, channel] in tasks:
-        nd2_worker = ND2Worker(multipoint, channel, report_strategy, pivlab_stream_processor)
-        nd2_worker.run()
-        if should_z_axis_profile or z_axis_profile_single_output_file:
-            mean_results.append({'multipoint': multipoint, 'channel': channel, 'mean_results': nd2_worker.get_mean_results()})
-    queue.put({'type': 'Done'})
-    Profiler.instance().end(time.time())
-    res = { 'profiler' : Profiler.instance().get_summary_data()}
-    if should_z_axis_profile:
-        res['z_axis_profile'] = mean_results
+    # every process gets its own slot of the MATLAB engine pool and its own row of progress counters
+    _worker_state['engine_slot'] = engine_slots.get()
+    _worker_state['report_strategy'] = SharedMemoryReportStrategy(progress_counters, _worker_state['engine_slot'])
+    _worker_state['pivlab_stream_processor'] = None
+
+
+def get_worker_piv_processor():
+    """PIV processor of the process, created on the first PIV series and closed when the process exits"""
+    arguments = Arguments.instance()
+    res = _worker_state['pivlab_stream_processor']
+    if res is None and arguments.is_pivlab():
+        res = get_piv_processor(arguments.piv_engine, _worker_state['report_strategy'],
+                                _worker_state['engine_slot'])
+        _worker_state['pivlab_stream_processor'] = res
+        Finalize(res, res.close, exitpriority=10)
     return res
 
 
-def poll_messages(queue, ui_queue, tasks_number, abort_event):
-    done_processes = 0
-    while done_processes != tasks_number:
+def handle_series(multipoint, channel, part):
+    """Handles a series, or the [start, stop) frames part of it"""
+    arguments = Arguments.instance()
+    start_time = time.time()
+    Profiler.instance().start(start_time)
+    nd2_worker = ND2Worker(multipoint, channel, _worker_state['report_strategy'], get_worker_piv_processor(), part)
+    nd2_worker.run()
+    _worker_state['report_strategy'].flush()
+    end_time = time.time()
+    Profiler.instance().end(end_time)
+    res = {'multipoint': multipoint, 'channel': channel, 'part': part, 'completed': nd2_worker.is_completed(),
+           'profiler': Profiler.instance().get_summary_data(), 'process_id': os.getpid(),
+           'start_time': start_time, 'end_time': end_time}
+    if part is not None and arguments.is_z_axis_profile():
+        res['z_axis_profile_results'] = nd2_worker.get_z_axis_profile_results()
+    elif arguments.z_axis_profile_plot or arguments.z_axis_profile_single_output_file:
+        res['z_axis_profile'] = nd2_worker.get_mean_results()
+    return res
+
+
+def wait_tasks(futures, abort_event):
+    """Waits for all the tasks to end, False when aborted first"""
+    pending = futures
+    while len(pending) > 0:
         if abort_event.is_set():
-            return
-        try:
-            item = queue.get(block=False)
-            if item['type'] == 'Done':
-                done_processes += 1
-            else:
-                if item['type'] == 'progress':
-                    ui_queue.put(item['progress_type'])
-        except Empty:
-            time.sleep(0.5)
-    ui_queue.put('Quit')
+            return False
+        _, pending = wait(pending, timeout=0.1)
+    return True
+
+
+def get_utilization(series_results, start_time, end_time):
+    """{process_id: {'series': handled series, 'busy_time': seconds, 'utilization': busy share of the run}}"""
+    res = {}
+    wall_time = end_time - start_time
+    for series_result in series_results:
+        entry = res.setdefault(series_result['process_id'], {'series': 0, 'busy_time': 0})
+        entry['series'] += 1
+        entry['busy_time'] += series_result['end_time'] - series_result['start_time']
+    for entry in res.values():
+        entry['utilization'] = entry['busy_time'] / wall_time if wall_time > 0 else 0
+    return res
+
+
+def get_utilization_message(utilization):
+    message = "Workers utilization\n-------------------\n"
+    for process_id, entry in sorted(utilization.items()):
+        message += (f"process {process_id} : {entry['series']} series, busy {entry['busy_time']:.2f} seconds "
+                    f"{entry['utilization'] * 100:.2f}%\n")
+    return message
 
 
 class RunWorkersThread(threading.Thread):
-    def __init__(self, multipoint_channel_generator, ui_queue, abort_event):
+    def __init__(self, tasks, ui_queue, abort_event):
+        """
+        tasks: [multipoint, channel, part] list, tasks are submitted in this order (largest first).
+        Progress is counted in progress_counters, a row per worker process and a last row for the merges.
+        """
         super().__init__()
-        self.multipoint_channel_generator = multipoint_channel_generator
+        self.tasks = tasks
+        self.workers = max(min(os.cpu_count(), len(tasks)), 1)
+        self.progress_counters = ProgressCounters(self.workers + 1)
         self.ui_queue = ui_queue
-        self.profiler_results = None
-        self.mean_results = None
+        self.profiler_results = []
+        self.mean_results = []
+        self.utilization = {}
         self.executor = None
         self.abort_event = abort_event
 
-    def get_tasks(self):
-        cores = os.cpu_count()
+    def merge_series_parts(self, series_results, failed_tasks):
+        """Outputs of split series are merged by frames order once all their parts are done"""
         res = []
-        core_index = 0
-        for [multipoint, channel] in self.multipoint_channel_generator:
-            if core_index == len(res):
-                res.append([[multipoint, channel]])
+        failed_series = {(multipoint, channel) for [multipoint, channel, _] in failed_tasks}
+        series_parts = {}
+        for series_result in series_results:
+            if series_result['part'] is None:
+                res.append(series_result)
             else:
-                res[core_index].append([multipoint, channel])
-            core_index = (core_index + 1) % cores
+                series_parts.setdefault((series_result['multipoint'], series_result['channel']), []).append(
+                    series_result)
+        report_strategy = SharedMemoryReportStrategy(self.progress_counters, self.workers)
+        for [multipoint, channel], parts in sorted(series_parts.items()):
+            parts = sorted(parts, key=lambda part_result: part_result['part'][0])
+            if (multipoint, channel) not in failed_series and all(part_result['completed'] for part_result in parts):
+                nd2_worker = ND2Worker(multipoint, channel, report_strategy)
+                nd2_worker.merge_parts([part_result['part'] for part_result in parts],
+                                       [part_result.get('z_axis_profile_results') for part_result in parts])
+                res.append({'multipoint': multipoint, 'channel': channel,
+                            'z_axis_profile': nd2_worker.get_mean_results()})
+            else:
+                print(f"multipoint {multipoint} channel {channel} has failed parts, its outputs are not merged")
+        report_strategy.flush()
         return res
 
     def run_workers(self):
-        tasks = self.get_tasks()
-        tasks_number = len(tasks)
         with Manager() as manager:
-            queue = manager.Queue()
+            engine_slots = manager.Queue()
+            for engine_slot in range(self.workers):
+                engine_slots.put(engine_slot)
             arguments = Arguments.instance()
-            args = [(task, queue, arguments) for task in tasks]
-            self.executor = ProcessPoolExecutor(max_workers=os.cpu_count())
-            futures = [self.executor.submit(handle_tasks, arg) for arg in args]
-            poll_messages(queue, self.ui_queue, tasks_number, self.abort_event)
-            if self.abort_event.is_set():
-                return [[], []]            
-            profiler_results = []
-            mean_results = []
+            start_time = time.time()
+            # a task per series, idle processes take the next series from the pool queue
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker,
+                                                initargs=(self.progress_counters, arguments, engine_slots))
+            futures = {self.executor.submit(handle_series, multipoint, channel, part): [multipoint, channel, part]
+                       for [multipoint, channel, part] in self.tasks}
+            if not wait_tasks(list(futures), self.abort_event):
+                return [[], [], {}]
+            series_results = []
+            failed_tasks = []
             for future in as_completed(futures):
-                profiler_results.append(future.result()['profiler'])
-                if arguments.z_axis_profile_plot or arguments.z_axis_profile_single_output_file:
-                    mean_results.extend(future.result()['z_axis_profile'])
+                try:
+                    series_results.append(future.result())
+                except Exception:
+                    [multipoint, channel, part] = futures[future]
+                    frames = '' if part is None else f" frames {part[0]}-{part[1]}"
+                    print(f"multipoint {multipoint} channel {channel}{frames} has failed")
+                    traceback.print_exc()
+                    failed_tasks.append(futures[future])
+            self.executor.shutdown()
+            end_time = time.time()
+        profiler_results = {}
+        for series_result in series_results:
+            process_id = series_result['process_id']
+            profiler_results[process_id] = add_summary_data(profiler_results.get(process_id),
+                                                            series_result['profiler'])
+        merged_results = self.merge_series_parts(series_results, failed_tasks)
+        mean_results = []
+        if arguments.z_axis_profile_plot or arguments.z_axis_profile_single_output_file:
+            mean_results = [{'multipoint': series_result['multipoint'], 'channel': series_result['channel'],
+                             'mean_results': series_result['z_axis_profile']} for series_result in merged_results]
         mean_results = sorted(mean_results, key=lambda d: (d['multipoint'], d['channel']))
-        return [profiler_results, mean_results]
+        return [list(profiler_results.values()), mean_results, get_utilization(series_results, start_time, end_time)]
 
     def run(self):
-        [self.profiler_results, self.mean_results] = self.run_workers()
+        try:
+            [self.profiler_results, self.mean_results, self.utilization] = self.run_workers()
+        finally:
+            # the progress window is closed also when the run fails
+            self.ui_queue.put('Quit')
 
     def terminate(self):
         for pid, proc in self.executor._processes.items():
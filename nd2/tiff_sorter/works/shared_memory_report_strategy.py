@@ -0,0 +1,58 @@
+from multiprocessing.shared_memory import SharedMemory
+from works.batched_report_strategy import BatchedReportStrategy
+import numpy as np
+
+PROGRESS_TYPES = ['Read', 'Write', 'Pivlab calls', 'Mean', 'Mean Write', 'Zarr Write']
+PROGRESS_TYPE_INDICES = {progress_type: index for index, progress_type in enumerate(PROGRESS_TYPES)}
+
+
+class ProgressCounters:
+    """
+    (rows, PROGRESS_TYPES) int64 counters in shared memory. Every reporting process owns a row, so a counter is
+    written by a single process and readers sum the rows without locking.
+    """
+
+    def __init__(self, rows, name=None):
+        self.rows = rows
+        self.owner = name is None
+        self.shared_memory = SharedMemory(name=name, create=self.owner, size=rows * len(PROGRESS_TYPES) * 8)
+        self.counters = np.ndarray((rows, len(PROGRESS_TYPES)), dtype=np.int64, buffer=self.shared_memory.buf)
+        if self.owner:
+            self.counters[:] = 0
+
+    def __getstate__(self):
+        # spawned processes attach to the shared memory by name
+        return {'rows': self.rows, 'name': self.shared_memory.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['rows'], state['name'])
+
+    def get_totals(self):
+        """{progress type: count summed over all rows}"""
+        totals = self.counters.sum(axis=0)
+        return {progress_type: int(totals[index]) for progress_type, index in PROGRESS_TYPE_INDICES.items()}
+
+    def unlink(self):
+        """Removes the shared memory name, the mapped counters stay valid until closed"""
+        if self.owner:
+            self.shared_memory.unlink()
+            self.owner = False
+
+    def close(self):
+        # the numpy view must be released before the shared memory buffer is closed
+        self.counters = None
+        self.shared_memory.close()
+        self.unlink()
+
+
+class SharedMemoryReportStrategy(BatchedReportStrategy):
+    """Adds the progress batches of the process to its row of ProgressCounters"""
+
+    def __init__(self, progress_counters, row):
+        super().__init__()
+        self.progress_counters = progress_counters
+        self.row = row
+
+    def publish(self, counts):
+        for progress_type, count in counts.items():
+            self.progress_counters.counters[self.row, PROGRESS_TYPE_INDICES[progress_type]] += count
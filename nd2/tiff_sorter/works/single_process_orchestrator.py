@@ -1,25 +1,22 @@
 from works.orchestrator import Orchestrator
-from works.single_process_report_strategy import SingleProcessReportStrategy
-from nd2_tools.nd2_wrapper import ND2Wrapper
+from works.shared_memory_report_strategy import ProgressCounters, SharedMemoryReportStrategy
+from nd2_tools.nd2_wrapper_factory import get_nd2_wrapper
 from works.nd2_worker import ND2Worker
 from profiling.profiler import Profiler
-from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor
-from gui.progress_window import ProgressWindow
-from gui.z_axis_profile_window import ZAxisProfileWindow
+from works.terminal_progress_reporter import TerminalProgressReporter
 import queue
 import threading
 import time
 import os
 from arguments.arguments import Arguments
-from matlab_integration.python_to_pivlab_streaming import PIVlabStreamProcessor
-from arguments.arguments import Arguments
+from piv_tools.piv_processor_factory import get_piv_processor
 
 
 class SingleProcessOrchestrator(Orchestrator):
     def __init__(self):
         super().__init__()
         arguments = Arguments.instance()
-        self.nd2_wrapper = ND2Wrapper.instance(arguments.input_file)
+        self.nd2_wrapper = get_nd2_wrapper(arguments.input_file, arguments.reader_backend)
         self.image_series = self.nd2_wrapper.get_multipoints_number()*self.nd2_wrapper.get_channels_number()
         self.report_strategy = None
         self.pivlab_stream_processor = None
@@ -27,6 +24,7 @@ class SingleProcessOrchestrator(Orchestrator):
         self.mean_results = None
         self.progress_window = None
         self.queue = queue.Queue()
+        self.progress_counters = None
 
     def worker_generator(self, multipoints, channels):
         for [multipoint, channel] in self.get_multipoint_channel_generator():
@@ -35,15 +33,16 @@ class SingleProcessOrchestrator(Orchestrator):
     def run_workers(self):
         arguments = Arguments.instance()
         z_axis_profile_plot = arguments.z_axis_profile_plot
-        self.report_strategy = SingleProcessReportStrategy(self.queue)
+        self.report_strategy = SharedMemoryReportStrategy(self.progress_counters, 0)
         if arguments.matlab_output_dir:
-            self.pivlab_stream_processor = PIVlabStreamProcessor(self.report_strategy)
+            self.pivlab_stream_processor = get_piv_processor(arguments.piv_engine, self.report_strategy)
         if z_axis_profile_plot is True:
             self.mean_results = []
         mean_results = {}
         for worker in self.worker_generator(self.nd2_wrapper.get_multipoints_number(),
                                             self.nd2_wrapper.get_channels_number()):
             worker.run()
+            self.report_strategy.flush()
             if z_axis_profile_plot is True:
                 self.mean_results.append({'multipoint': worker.get_multipoint(),
                                           'channel': worker.get_channel(),
@@ -56,16 +55,32 @@ class SingleProcessOrchestrator(Orchestrator):
 
     def run(self):
         Profiler.instance().start(time.time())
-        self.progress_window = ProgressWindow(self.progress_data, self.progress_order, self.queue)
-        run_workers_thread = threading.Thread(target=self.run_workers, daemon=True)
-        run_workers_thread.start()
-        self.progress_window.start()
-        if self.progress_window.aborted:
-            print('aborted !')
-            return
-        Profiler.instance().end(time.time())
+        self.prepare_outputs()
+        self.progress_counters = ProgressCounters(1)
         arguments = Arguments.instance()
+        if arguments.headless:
+            progress_reporter = TerminalProgressReporter(self.progress_data, self.progress_order,
+                                                         self.progress_counters)
+            progress_reporter.start()
+            self.run_workers()
+            progress_reporter.stop()
+        else:
+            from gui.progress_window import ProgressWindow
+            self.progress_window = ProgressWindow(self.progress_data, self.progress_order, self.queue,
+                                                  self.progress_counters)
+            run_workers_thread = threading.Thread(target=self.run_workers, daemon=True)
+            run_workers_thread.start()
+            self.progress_window.start()
+            if self.progress_window.aborted:
+                print('aborted !')
+                # the daemon worker thread may still count, the memory is released when the process exits
+                self.progress_counters.unlink()
+                return
+            run_workers_thread.join()
+        self.progress_counters.close()
+        Profiler.instance().end(time.time())
         if arguments.z_axis_profile_plot is True:
+            from gui.z_axis_profile_window import ZAxisProfileWindow
             z_axis_profile_window = ZAxisProfileWindow(self.mean_results, arguments.input_file)
             z_axis_profile_window.start()
 
@@ -1,27 +0,0 @@
-from works.report_strategy import ReportStrategy
-from profiling.profiler import Profiler
-import os
-import time
-
-
-class SingleProcessReportStrategy(ReportStrategy):
-
-    def __init__(self, queue):
-        self.queue = queue
-
-    def read_progress(self):
-        self.queue.put('Read')
-
-    def write_progress(self):
-        self.queue.put('Write')
-
-    def matlab_progress(self):
-        self.queue.put('Pivlab calls')
-
-    def mean_progress(self):
-        self.queue.put('Mean')
-
-    def mean_write_progress(self):
-        self.queue.put('Mean Write')
-
-
@@ -0,0 +1,37 @@
+from config.settings import Settings
+import threading
+
+
+class TerminalProgressReporter(threading.Thread):
+    """
+    Progress of a headless run, prints the totals of the progress counters every headless_progress_interval
+    seconds (default 10, 0 prints nothing) and once more when stopped
+    """
+
+    def __init__(self, data, order, progress_counters):
+        super().__init__(daemon=True)
+        self.data = data
+        self.order = order
+        self.progress_counters = progress_counters
+        interval = Settings.instance().get('headless_progress_interval')
+        self.interval = 10 if interval is None else float(interval)
+        self.stop_event = threading.Event()
+
+    def get_message(self):
+        totals = self.progress_counters.get_totals()
+        return ' | '.join(f"{title} {min(totals[title], self.data[title]['maximum'])}/{self.data[title]['maximum']} "
+                          f"{self.data[title]['units']}" for title in self.order)
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            print(self.get_message(), flush=True)
+
+    def start(self):
+        if self.interval > 0:
+            super().start()
+
+    def stop(self):
+        if self.interval > 0:
+            self.stop_event.set()
+            self.join()
+            print(self.get_message(), flush=True)
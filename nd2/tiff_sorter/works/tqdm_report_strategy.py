@@ -0,0 +1,30 @@
+from works.report_strategy import ReportStrategy
+
+
+class TqdmReportStrategy(ReportStrategy):
+    """Reports progress to tqdm progress bars, progress_bars maps progress type ('Read', 'Write'...) to a bar"""
+
+    def __init__(self, progress_bars):
+        self.progress_bars = progress_bars
+
+    def update(self, progress_type):
+        if progress_type in self.progress_bars:
+            self.progress_bars[progress_type].update(1)
+
+    def read_progress(self):
+        self.update('Read')
+
+    def write_progress(self):
+        self.update('Write')
+
+    def matlab_progress(self):
+        self.update('Pivlab calls')
+
+    def mean_progress(self):
+        self.update('Mean')
+
+    def mean_write_progress(self):
+        self.update('Mean Write')
+
+    def zarr_write_progress(self):
+        self.update('Zarr Write')
@@ -0,0 +1,108 @@
+# OME-Zarr output: a (T, C, Y, X) array per multipoint, chunked (chunk_t, 1, chunk_y, chunk_x)
+# Every (multipoint, channel) series owns its chunks, so worker processes write series in parallel without locking
+import os
+import time
+import numpy as np
+import zarr
+import numcodecs
+from profiling.profiler import Profiler
+from tiff_tools.tiff_writers import FrameWriter
+
+
+def get_zarr_compressor(name, level=5):
+    res = None
+    if name in ['zstd', 'lz4']:
+        res = numcodecs.Blosc(cname=name, clevel=level, shuffle=numcodecs.Blosc.BITSHUFFLE)
+    elif name == 'zlib':
+        res = numcodecs.Zlib(level=level)
+    return res
+
+
+def get_multipoint_group_name(multipoint):
+    return f"multipoint_{multipoint}"
+
+
+def create_ome_zarr_store(store_path, series_shapes, timepoints, dtype, channel_names, chunks, compressor):
+    """
+    Creates the store and its empty arrays before workers start writing.
+
+    series_shapes: {multipoint: {channel: (y, x)}} of the series to export
+    timepoints: range of the exported timepoints, the t axis is scaled and translated to nd2 timepoints
+    chunks: (chunk_t, chunk_y, chunk_x)
+    """
+    root = zarr.open_group(store_path, mode='w')
+    chunk_t, chunk_y, chunk_x = chunks
+    for multipoint, channel_shapes in series_shapes.items():
+        channels = sorted(channel_shapes.keys())
+        shapes = set(channel_shapes.values())
+        if len(shapes) != 1:
+            raise ValueError(f"All channels of multipoint {multipoint} must have the same ROI size to be "
+                             f"exported to a single (T, C, Y, X) array, got {channel_shapes}")
+        y, x = shapes.pop()
+        group = root.create_group(get_multipoint_group_name(multipoint))
+        group.create_dataset('0', shape=(len(timepoints), len(channels), y, x),
+                             chunks=(chunk_t, 1, min(chunk_y, y), min(chunk_x, x)),
+                             dtype=dtype, compressor=get_zarr_compressor(compressor), fill_value=0)
+        group.attrs['multiscales'] = [{
+            'version': '0.4',
+            'name': get_multipoint_group_name(multipoint),
+            'axes': [{'name': 't', 'type': 'time'},
+                     {'name': 'c', 'type': 'channel'},
+                     {'name': 'y', 'type': 'space'},
+                     {'name': 'x', 'type': 'space'}],
+            'datasets': [{'path': '0', 'coordinateTransformations': [
+                {'type': 'scale', 'scale': [timepoints.step, 1, 1, 1]},
+                {'type': 'translation', 'translation': [timepoints.start, 0, 0, 0]}]}]
+        }]
+        group.attrs['omero'] = {'channels': [{'label': channel_names[channel]} for channel in channels]}
+        # position of each nd2 channel on the array c axis
+        group.attrs['channel_indices'] = {str(channel): index for index, channel in enumerate(channels)}
+
+
+class ZarrSeriesWriter(FrameWriter):
+    """
+    Writes a (multipoint, channel) series into its slot of the multipoint array.
+    Frames are gathered into a block of chunk_t frames, so every chunk is written once, as a whole.
+    """
+    concurrent_writes = False
+
+    def __init__(self, store_path, multipoint, channel, report_strategy):
+        super().__init__(report_strategy)
+        group = zarr.open_group(store_path, mode='r+')[get_multipoint_group_name(multipoint)]
+        self.array = group['0']
+        self.channel_index = group.attrs['channel_indices'][str(channel)]
+        self.block = None
+        self.block_start = 0
+        self.block_frames = 0
+
+    def flush(self):
+        if self.block_frames > 0:
+            write_start = time.time()
+            self.array[self.block_start:self.block_start + self.block_frames, self.channel_index] = \
+                self.block[:self.block_frames]
+            Profiler.instance().inc('zarr_write', time.time() - write_start)
+            for _ in range(self.block_frames):
+                self.report_strategy.zarr_write_progress()
+        self.block_start += self.block_frames
+        self.block_frames = 0
+
+    def write(self, frame_idx, image):
+        if self.block is None:
+            self.block = np.empty((self.array.chunks[0],) + image.shape, dtype=image.dtype)
+            self.block_start = frame_idx
+        self.block[self.block_frames] = image
+        self.block_frames += 1
+        # blocks end on chunk boundaries, also when a resumed series starts inside a chunk
+        if (self.block_start + self.block_frames) % len(self.block) == 0:
+            self.flush()
+
+    def get_resume_frame(self):
+        # zarr stores replace chunk files atomically, flushed blocks are complete
+        return self.block_start
+
+    def close(self):
+        self.flush()
+
+
+def get_zarr_store_path(output_dir, input_file, suffix=''):
+    return os.path.join(output_dir, os.path.splitext(os.path.basename(input_file))[0] + suffix + '.ome.zarr')